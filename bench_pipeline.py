@@ -0,0 +1,132 @@
+"""
+Benchmark the processing stages on synthetic corpora of increasing size.
+
+For each size a seeded corpus is written with synthetic.write_corpus (and reused on later
+runs), then each stage runs in a fresh process so its peak memory can be read from the OS.
+Reports seconds, rows per second and peak resident memory per stage and size, optionally
+appended to a JSONL file. With --baseline, exits with status 1 if any stage got slower
+than a previous run by more than --tolerance.
+
+    python bench_pipeline.py --sizes 10000 100000 1000000 --out bench.jsonl
+    python bench_pipeline.py --sizes 100000 --stages filter edges summary --baseline bench.jsonl
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import datetime
+import multiprocessing
+from synthetic import write_corpus
+
+STAGES = ['process', 'filter', 'partition', 'edges', 'summary']
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+parser.add_argument('--data', type=str, default='data/synthetic', help='Folder holding the generated corpora')
+parser.add_argument('--team', type=str, default='eagles')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--workers', type=int, default=1, help='Sentiment scoring processes for the process stage')
+parser.add_argument('--backend', type=str, default='vader')
+parser.add_argument('--out', type=str, default=None, help='JSONL file to append results to')
+parser.add_argument('--baseline', type=str, default=None, help='JSONL results to compare rows/s against')
+parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed fractional slowdown against the baseline')
+
+
+def _peak_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def run_stage(stage, corpus, team, workers, backend):
+    """
+    Run one stage on a corpus and return (rows out, seconds, peak MB, MB at start).
+    """
+    import utils
+    from cube import build_cube
+
+    raw = os.path.join(corpus, 'raw', team + '.csv')
+    processed = os.path.join(corpus, 'processed', team + '.csv')
+    start_mb = _peak_mb()
+    start = time.perf_counter()
+
+    if stage == 'process':
+        coms, meta = utils.process_coms(raw, no_zero_sentiment=True, n_workers=workers, backend=backend)
+        rows_out = len(coms)
+    elif stage == 'filter':
+        coms, meta = utils.filter_processed_coms_by_date(processed, datetime.datetime(2022, 9, 8), datetime.datetime(2023, 2, 13))
+        rows_out = len(coms)
+    elif stage == 'partition':
+        weeks, phases = utils.partition_processed_coms(processed)
+        rows_out = sum(len(d) for d, _ in weeks.values())
+    elif stage == 'edges':
+        edges = utils.get_sub_edges(processed, utils.teams.subreddit.values)
+        rows_out = len(edges)
+    elif stage == 'summary':
+        cube = build_cube({'all': os.path.join(corpus, 'teams')})
+        summary = cube.summary_stats(['all'])
+        rows_out = len(summary)
+
+    seconds = time.perf_counter() - start
+    return rows_out, seconds, _peak_mb(), start_mb
+
+
+def ensure_corpus(args, rows):
+    corpus = os.path.join(args.data, str(rows))
+    if not os.path.exists(os.path.join(corpus, 'teams', args.team + '.csv')):
+        print('generating', corpus)
+        write_corpus(corpus, rows, args.team, args.seed)
+    return corpus
+
+
+def compare(results, baseline_file, tolerance):
+    """
+    Stages whose rows/s fell more than tolerance below the best baseline run at the same size.
+    """
+    best = dict()
+    with open(baseline_file, 'r') as f:
+        for line in f:
+            r = json.loads(line)
+            key = (r['stage'], r['rows'])
+            best[key] = max(best.get(key, 0), r['rows_per_s'])
+
+    slower = []
+    for r in results:
+        base = best.get((r['stage'], r['rows']))
+        if base and r['rows_per_s'] < (1 - tolerance) * base:
+            slower.append((r['stage'], r['rows'], r['rows_per_s'], base))
+    return slower
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    ctx = multiprocessing.get_context('spawn')
+
+    print('{:>10} {:>10} {:>10} {:>12} {:>10} {:>10}'.format('stage', 'rows', 'seconds', 'rows/s', 'peak MB', 'rows out'))
+    results = []
+    for rows in args.sizes:
+        corpus = ensure_corpus(args, rows)
+        for stage in args.stages:
+            # A fresh interpreter per stage, so peak memory is the stage's own
+            with ctx.Pool(1) as pool:
+                rows_out, seconds, peak_mb, start_mb = pool.apply(
+                    run_stage, (stage, corpus, args.team, args.workers, args.backend))
+
+            r = dict(stage=stage, rows=rows, seconds=seconds, rows_per_s=rows / seconds, peak_mb=peak_mb,
+                     stage_mb=peak_mb - start_mb, rows_out=rows_out, backend=args.backend,
+                     time=datetime.datetime.now().isoformat(timespec='seconds'))
+            results.append(r)
+            print('{:>10} {:>10} {:>10.2f} {:>12.0f} {:>10.0f} {:>10}'.format(stage, rows, seconds, r['rows_per_s'], peak_mb, rows_out))
+
+    if args.out:
+        with open(args.out, 'a') as f:
+            for r in results:
+                f.write(json.dumps(r) + '\n')
+
+    if args.baseline:
+        slower = compare(results, args.baseline, args.tolerance)
+        for stage, rows, now, base in slower:
+            print('REGRESSION {} at {} rows: {:.0f} rows/s vs {:.0f} in the baseline'.format(stage, rows, now, base))
+        sys.exit(int(len(slower) > 0))
@@ -0,0 +1,98 @@
+"""
+Throughput benchmark for the concurrent author-history fetcher in scrape.py.
+
+Runs fetch_author_histories against an in-process stand-in for the Reddit API that
+sleeps to simulate network latency and fails a fraction of requests, and reports
+authors per second for a given request budget.
+
+    python bench_scrape.py --authors 200 --workers 8 --rate 20 --latency 0.2
+"""
+import time
+import random
+import argparse
+import prawcore
+from scrape import scrape_posts_or_comments, fetch_author_histories
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--authors', type=int, default=200)
+parser.add_argument('--Ncomments', type=int, nargs='+', default=[100, 250], help='Comments per author. Above 100 an attempt costs several requests')
+parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16])
+parser.add_argument('--rate', type=float, default=20., help='API requests per second')
+parser.add_argument('--latency', type=float, default=0.2, help='Seconds per API request')
+parser.add_argument('--error_rate', type=float, default=0.02, help='Fraction of requests failing with a 503')
+parser.add_argument('--banned_rate', type=float, default=0.01, help='Fraction of authors returning 403')
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeComment:
+    def __init__(self, author, ii):
+        self.author = author
+        self.body = 'Comment {} by {}'.format(ii, author)
+        self.score = ii
+        self.subreddit = 'nfl'
+        self.link_id = 't3_{}'.format(ii)
+        self.over_18 = False
+        self.controversiality = 0
+        self.author_flair_text = ':Eagles: Eagles'
+        self.created_utc = 1.67e9 - 3600 * ii
+
+
+class FakeListing:
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.name = name
+
+    def new(self, limit=10):
+        # One simulated request per page of 100 comments
+        for ii in range(limit):
+            if ii % 100 == 0:
+                time.sleep(self.reddit.latency)
+                if self.name in self.reddit.banned:
+                    raise prawcore.exceptions.Forbidden(FakeResponse(403))
+                if random.random() < self.reddit.error_rate:
+                    raise prawcore.exceptions.ServerError(FakeResponse(503))
+            yield FakeComment(self.name, ii)
+
+
+class FakeRedditor:
+    def __init__(self, reddit, name):
+        self.comments = FakeListing(reddit, name)
+
+
+class FakeReddit:
+    """
+    Minimal stand-in for praw.Reddit serving redditor comment listings.
+    """
+
+    def __init__(self, latency=0.2, error_rate=0.02, banned=()):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.banned = set(banned)
+
+    def redditor(self, name):
+        return FakeRedditor(self, name)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    random.seed(0)
+
+    authors = ['user{}'.format(ii) for ii in range(args.authors)]
+    banned = random.sample(authors, int(args.banned_rate * args.authors))
+    reddit = FakeReddit(args.latency, args.error_rate, banned)
+
+    for N in args.Ncomments:
+        fetch = lambda author: scrape_posts_or_comments(author, kind='redditor', N=N, reddit=reddit)
+        print('authors={} Ncomments={} rate={}/s latency={}s'.format(args.authors, N, args.rate, args.latency))
+        for n_workers in args.workers:
+            start = time.time()
+            n_rows = 0
+            for author, df in fetch_author_histories(authors, N=N, n_workers=n_workers, rate=args.rate,
+                                                     backoff=0.1, fetch=fetch):
+                n_rows += 0 if df is None else len(df)
+            elapsed = time.time() - start
+            print('workers={:3d} {:8.1f} authors/s {:8.0f} comments/s'.format(n_workers, args.authors / elapsed, n_rows / elapsed))
@@ -0,0 +1,68 @@
+"""
+Parity check and throughput benchmark for the batched VADER scorer in vader_batch.py.
+
+Splits a sample of comments into sentences, scores them with the reference
+SentimentIntensityAnalyzer and with BatchVader, and reports the largest compound score
+difference and sentences per second for each. Comments without sentences, such as empty
+or whitespace-only bodies, are checked to score 0 with both backends. Exits with status 1
+if any score differs by more than vader_batch.TOLERANCE.
+
+    python bench_sentiment.py data/nfl_nonzero/processed/comments/eagles.csv --sample 20000
+"""
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from nltk import tokenize
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from vader_batch import BatchVader, TOLERANCE
+import sentiment
+
+parser = argparse.ArgumentParser()
+parser.add_argument('files', nargs='+', help='Comment CSV files')
+parser.add_argument('--sample', type=int, default=20000, help='Number of comments to sample')
+parser.add_argument('--batch', type=int, default=50000, help='Sentences scored per BatchVader call')
+parser.add_argument('--seed', type=int, default=0)
+
+# Bodies with no sentences
+EMPTY_BODIES = ['', ' ', '\n\t ']
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    bodies = pd.concat([pd.read_csv(f, lineterminator='\n', usecols=['body']) for f in args.files]).body.dropna()
+    bodies = bodies.sample(min(args.sample, len(bodies)), random_state=args.seed).values
+    sentences = [s for body in bodies for s in tokenize.sent_tokenize(body)]
+    print('comments={} sentences={}'.format(len(bodies), len(sentences)))
+
+    analyzer = SentimentIntensityAnalyzer()
+    batch = BatchVader(analyzer)
+
+    start = time.time()
+    reference = np.array([analyzer.polarity_scores(s)['compound'] for s in sentences])
+    t_reference = time.time() - start
+
+    start = time.time()
+    scores = np.concatenate([batch.score_sentences(sentences[i:i + args.batch])
+                             for i in range(0, len(sentences), args.batch)])
+    t_batch = time.time() - start
+
+    diff = np.abs(scores - reference)
+    print('reference {:10.0f} sentences/s'.format(len(sentences) / t_reference))
+    print('numpy     {:10.0f} sentences/s  ({:.1f}x)'.format(len(sentences) / t_batch, t_reference / t_batch))
+    print('max |diff| {:.2g}, {} sentences differ, tolerance {:g}'.format(diff.max(), (diff > 0).sum(), TOLERANCE))
+
+    for i in np.argsort(-diff)[:5]:
+        if diff[i] > TOLERANCE:
+            print('  {!r}: reference {} numpy {}'.format(sentences[i], reference[i], scores[i]))
+
+    # Comment-level parity on bodies without sentences, which must score 0 so they are filtered out
+    sentiment._init_worker('vader')
+    empty_reference = np.array([sentiment.comment_sentiment(body) for body in EMPTY_BODIES])
+    empty_scores = batch.score_comments(EMPTY_BODIES)
+    empty_ok = np.array_equal(empty_reference, np.zeros(len(EMPTY_BODIES))) and np.array_equal(empty_scores, empty_reference)
+    print('bodies without sentences: reference {} numpy {}'.format(empty_reference.tolist(), empty_scores.tolist()))
+
+    sys.exit(int(diff.max() > TOLERANCE or not empty_ok))
@@ -0,0 +1,100 @@
+"""
+Load test for the query service in serve.py.
+
+Starts the service in-process on the given outputs (or targets a running one with --url)
+and sends a mix of weekly-metric and top-rivals queries from concurrent clients. Reports
+throughput and p50/p99 latency, first for queries spread over every team and parameter
+(mostly cache misses at first) and then for a small hot set answered from the LRU cache.
+
+    python bench_serve.py data/nfl_nonzero --requests 5000 --clients 8
+    python bench_serve.py --url http://127.0.0.1:8765 --requests 20000
+"""
+import time
+import random
+import argparse
+import threading
+import numpy as np
+from serve import QueryServer, QueryClient, METRICS
+
+parser = argparse.ArgumentParser()
+parser.add_argument('outdir', type=str, nargs='?', default='data/nfl_nonzero', help='Pipeline outputs to serve in-process')
+parser.add_argument('--url', type=str, default=None, help='Address of a running service. Skips the in-process server')
+parser.add_argument('--requests', type=int, default=5000)
+parser.add_argument('--clients', type=int, default=8)
+parser.add_argument('--hot', type=int, default=50, help='Distinct queries in the hot set')
+parser.add_argument('--seed', type=int, default=0)
+
+
+def random_queries(n, teams, weeks, phases, rng):
+    """
+    A mix of weekly-metric and rivals queries as (method, kwargs) pairs.
+    """
+    queries = []
+    for _ in range(n):
+        team = rng.choice(teams)
+        if rng.random() < 0.7:
+            direction = rng.choice(['in', 'out', 'self'])
+            metric = 'sent' if direction == 'self' else rng.choice(METRICS)
+            start = rng.randrange(len(weeks))
+            stop = rng.randrange(start, len(weeks))
+            queries.append(('metric', dict(team=team, metric=metric, direction=direction, start=weeks[start], stop=weeks[stop])))
+        else:
+            queries.append(('rivals', dict(team=team, phase=rng.choice(phases), k=rng.choice([3, 5, 10]),
+                                           metric=rng.choice(METRICS), direction=rng.choice(['in', 'out']))))
+    return queries
+
+
+def run_load(client, queries, n_clients):
+    """
+    Send the queries from n_clients threads and return (latencies in seconds, wall seconds).
+    """
+    latencies = [[] for _ in range(n_clients)]
+
+    def worker(i):
+        for method, kwargs in queries[i::n_clients]:
+            start = time.perf_counter()
+            getattr(client, method)(**kwargs)
+            latencies[i].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return np.concatenate([np.array(l) for l in latencies]), time.perf_counter() - start
+
+
+def report(name, latencies, seconds):
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print('{:>8} {:>8} {:>10.0f} {:>9.2f} {:>9.2f}'.format(name, len(latencies), len(latencies) / seconds, p50, p99))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = QueryServer(args.outdir, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    client = QueryClient(url)
+    stats = client.stats()
+    weeks = [b for b in stats['buckets'] if b.isdigit()]
+    phases = [b for b in stats['buckets'] if not b.isdigit()]
+    rng = random.Random(args.seed)
+
+    print('{:>8} {:>8} {:>10} {:>9} {:>9}'.format('queries', 'requests', 'per s', 'p50 ms', 'p99 ms'))
+    spread = random_queries(args.requests, stats['teams'], weeks, phases, rng)
+    report('spread', *run_load(client, spread, args.clients))
+
+    hot = random_queries(args.hot, stats['teams'], weeks, phases, rng)
+    report('hot', *run_load(client, [rng.choice(hot) for _ in range(args.requests)], args.clients))
+
+    cache = client.stats()['cache']
+    print('cache hits: metric {hits}/{total}'.format(hits=cache['metric']['hits'], total=cache['metric']['hits'] + cache['metric']['misses']),
+          'rivals {hits}/{total}'.format(hits=cache['rivals']['hits'], total=cache['rivals']['hits'] + cache['rivals']['misses']))
+    if server is not None:
+        server.shutdown()
@@ -0,0 +1,227 @@
+"""
+Bootstrap confidence intervals for edge and summary metrics.
+
+Each replicate resamples, with replacement, the comments of every (bucket, source team)
+comment file, the input of one get_sub_edges call, and recomputes the normalized edges and
+team summaries from the resampled sums. All replicates of a bucket are drawn at once from
+grouped index arrays and summed with bincount, and buckets run across a process pool.
+Every bucket has its own seeded generator, so results do not depend on the number of workers.
+
+    python bootstrap.py data/nfl_nonzero --n_boot 1000 --workers 8
+"""
+import os
+import warnings
+import argparse
+from multiprocessing import Pool
+import numpy as np
+from cube import METRICS, SUMMARY_COLUMNS, normalize_sums, summarize_edges
+from registry import default_registry
+from utils import read_coms, is_store, PHASE_WINDOWS
+from instrument import start_stage
+
+parser = argparse.ArgumentParser()
+parser.add_argument('outdir', type=str, help='Output folder with weeks/<week>/comments and <phase>/comments')
+parser.add_argument('--n_boot', type=int, default=1000)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--alpha', type=float, default=0.05, help='Intervals cover 1 - alpha')
+parser.add_argument('--n_weeks', type=int, default=25)
+parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+# Resampled comments held in memory at once, as replicates x comments
+BATCH_ELEMENTS = 1 << 22
+
+
+def read_bucket(folder, teams):
+    """
+    Comments of one bucket folder as flat arrays, in the layout build_cube reads.
+
+    Returns:
+    - source (np.ndarray): Team index of the commenter, from the file the comment is in.
+    - target (np.ndarray): Team index of the subreddit the comment was left in.
+    - values (np.ndarray): (3, n) sentiment, controversiality and score, missing values as 0.
+    """
+    team2id = dict(zip(teams, range(len(teams))))
+    source, target, values = [], [], []
+    for team in teams:
+        filename = '{}/{}'.format(folder, team)
+        if not is_store(filename):
+            filename += '.csv'
+        try:
+            coms = read_coms(filename, columns=['subreddit', 'sentiment', 'controversiality', 'score'])
+        except FileNotFoundError:
+            continue
+
+        t = coms.subreddit.str.lower().map(team2id)
+        inside = t.notna().values
+        source.append(np.full(inside.sum(), team2id[team], dtype=np.int64))
+        target.append(t.values[inside].astype(np.int64))
+        values.append(coms[METRICS[1:]].values[inside].astype(float).T)
+
+    if not source:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.zeros((3, 0))
+    return np.concatenate(source), np.concatenate(target), np.nan_to_num(np.concatenate(values, axis=1))
+
+
+def resample_sums(source, target, values, n_teams, n_boot, rng):
+    """
+    Raw (source, target, metric) sums of bootstrap replicates.
+
+    Comments are resampled with replacement within each source team, keeping each team's
+    comment count, so the replicates follow the sampling of the per-team comment files.
+
+    Args:
+    - source, target (np.ndarray): Team index of the commenter and of the subreddit of each comment.
+    - values (np.ndarray): (3, n) sentiment, controversiality and score of each comment.
+    - n_teams (int): Number of teams.
+    - n_boot (int): Number of replicates.
+    - rng (np.random.Generator): Random generator.
+
+    Returns:
+    - sums (np.ndarray): (n_boot, source, target, 4) sums in the METRICS order of the cube.
+    """
+    n = len(source)
+    sums = np.zeros((n_boot, n_teams, n_teams, len(METRICS)))
+    if n == 0:
+        return sums
+
+    # Group comments by source; each position draws from its own group
+    order = np.argsort(source, kind='stable')
+    source, target, values = source[order], target[order], values[:, order]
+    sizes = np.bincount(source, minlength=n_teams)
+    starts = np.cumsum(sizes) - sizes
+    start, size = starts[source], sizes[source].astype(np.float32)
+    cell = source * n_teams + target  # (source, target) cell of each comment
+
+    n_cells = n_teams * n_teams
+    batch = max(1, BATCH_ELEMENTS // n)
+    for r0 in range(0, n_boot, batch):
+        rb = min(batch, n_boot - r0)
+        idx = start + (rng.random((rb, n), dtype=np.float32) * size).astype(np.int64)
+        np.minimum(idx, start + sizes[source] - 1, out=idx)  # float32 rounding can reach the group end
+        key = (cell[idx] + n_cells * np.arange(rb)[:, None]).ravel()
+
+        out = sums[r0:r0 + rb].reshape(rb * n_cells, len(METRICS))
+        out[:, 0] = np.bincount(key, minlength=rb * n_cells)
+        for j in range(3):
+            out[:, j + 1] = np.bincount(key, weights=values[j][idx].ravel(), minlength=rb * n_cells)
+    return sums
+
+
+def bootstrap_bucket(folder, teams, n_boot=1000, seed=0, alpha=0.05):
+    """
+    Confidence intervals of one bucket's edges and team summaries.
+
+    Args:
+    - folder (str): Folder with one comments file per team, e.g. 'data/nfl_nonzero/weeks/3/comments'.
+    - teams (list): Team subreddits.
+    - n_boot (int): Number of bootstrap replicates.
+    - seed (int or list): Seed of the bucket's random generator.
+    - alpha (float): Intervals are the alpha/2 and 1 - alpha/2 percentiles of the replicates.
+
+    Returns:
+    - edge_ci (np.ndarray): (2, source, target, 4) lower and upper bounds of the normalized edge metrics.
+    - summary_ci (np.ndarray): (2, team, 9) lower and upper bounds of the SUMMARY_COLUMNS.
+    """
+    source, target, values = read_bucket(folder, teams)
+    sums = resample_sums(source, target, values, len(teams), n_boot, np.random.default_rng(seed))
+
+    edges, valid = normalize_sums(sums)
+    summary = summarize_edges(edges, valid)
+    edges = np.where(valid[..., None], edges, np.nan)
+
+    q = [alpha / 2, 1 - alpha / 2]
+    with warnings.catch_warnings():
+        # Edges never seen in a bucket have no replicates, so their bounds are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanquantile(edges, q, axis=0), np.nanquantile(summary, q, axis=0)
+
+
+def _bootstrap_task(task):
+    return bootstrap_bucket(*task)
+
+
+def bootstrap_buckets(bucket_dirs, n_boot=1000, seed=0, alpha=0.05, n_workers=None, teams=None, report=None):
+    """
+    Confidence intervals for every bucket.
+
+    Args:
+    - bucket_dirs (dict): Maps a bucket label to a folder with one comments file per team, as for build_cube.
+    - n_boot (int): Number of bootstrap replicates.
+    - seed (int): Seed. Bucket i draws from np.random.default_rng([seed, i]).
+    - alpha (float): Intervals cover 1 - alpha.
+    - n_workers (int): Number of processes. Defaults to the number of CPUs.
+    - teams (list): Team subreddits. Defaults to all teams.
+    - report (RunReport): Optional run report to record timings in.
+
+    Returns:
+    - ci (BootstrapIntervals): Bounds for every bucket.
+    """
+    record = start_stage(report, 'bootstrap', n_boot=n_boot)
+    teams = list(default_registry().teams.subreddit) if teams is None else list(teams)
+    tasks = [(folder, teams, n_boot, [seed, i], alpha) for i, folder in enumerate(bucket_dirs.values())]
+
+    if n_workers == 1 or len(tasks) == 1:
+        results = [_bootstrap_task(task) for task in tasks]
+    else:
+        with Pool(n_workers) as pool:
+            results = pool.map(_bootstrap_task, tasks)
+
+    edge_ci = np.stack([r[0] for r in results])
+    summary_ci = np.stack([r[1] for r in results])
+    record.finish(rows_out=len(results))
+    return BootstrapIntervals(list(bucket_dirs), teams, edge_ci, summary_ci, dict(n_boot=n_boot, seed=seed, alpha=alpha))
+
+
+class BootstrapIntervals:
+    """
+    Bootstrap bounds of edge and summary metrics, indexed like InteractionCube.
+
+    - edge_ci: (bucket, 2, source, target, 4) bounds of volume, sentiment, controversiality and score.
+    - summary_ci: (bucket, 2, team, 9) bounds of the SUMMARY_COLUMNS.
+    """
+
+    def __init__(self, buckets, teams, edge_ci, summary_ci, params):
+        self.buckets = [str(b) for b in buckets]
+        self.teams = list(teams)
+        self.bucket2id = dict(zip(self.buckets, range(len(self.buckets))))
+        self.edge_ci = edge_ci
+        self.summary_ci = summary_ci
+        self.params = params
+
+    def save(self, path):
+        np.savez(path, buckets=self.buckets, teams=self.teams, edge_ci=self.edge_ci, summary_ci=self.summary_ci,
+                 **{'param_' + k: v for k, v in self.params.items()})
+
+    @classmethod
+    def load(cls, path):
+        d = np.load(path)
+        params = {k[len('param_'):]: d[k].item() for k in d.files if k.startswith('param_')}
+        return cls(list(d['buckets']), list(d['teams']), d['edge_ci'], d['summary_ci'], params)
+
+    def add_to_summary(self, df, bucket):
+        """
+        Insert <metric>_lo and <metric>_hi columns after each metric of a summary_stats table.
+        """
+        ci = self.summary_ci[self.bucket2id[str(bucket)]]
+        df = df.copy()
+        for j, column in enumerate(SUMMARY_COLUMNS):
+            at = df.columns.get_loc(column) + 1
+            df.insert(at, column + '_lo', ci[0, :, j])
+            df.insert(at + 1, column + '_hi', ci[1, :, j])
+        return df
+
+    def edge_bounds(self, bucket, metric='sentiment'):
+        """
+        (2, source, target) lower and upper bounds of one edge metric.
+        """
+        return self.edge_ci[self.bucket2id[str(bucket)], :, :, :, METRICS.index(metric)]
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    weeks = [str(week) for week in range(args.n_weeks)]
+    bucket_dirs = {bucket: '{}/{}/comments'.format(args.outdir, bucket if bucket in PHASE_WINDOWS else 'weeks/' + bucket)
+                   for bucket in weeks + list(PHASE_WINDOWS)}
+    ci = bootstrap_buckets(bucket_dirs, args.n_boot, args.seed, args.alpha, args.workers)
+    ci.save(os.path.join(args.outdir, 'bootstrap.npz'))
+    print('Saved bounds for', len(ci.buckets), 'buckets to', os.path.join(args.outdir, 'bootstrap.npz'))
@@ -0,0 +1,216 @@
+import json
+import numpy as np
+import pandas as pd
+from utils import read_coms, aggregate_edge_sums, is_store
+from registry import default_registry
+from instrument import start_stage
+
+# Raw sums kept for every (bucket, source, target). Keeping sums rather than averages
+# means cubes over disjoint comments can be merged by adding them.
+METRICS = ['count', 'sentiment', 'controversiality', 'score']
+
+SUMMARY_COLUMNS = ['in_weight', 'out_weight', 'in_sent', 'out_sent', 'in_cont', 'out_cont', 'in_score', 'out_score', 'self_sent']
+
+
+class InteractionCube:
+    """
+    Comment sums indexed by (time bucket, source team, target team, metric).
+
+    The source team is the flair of the commenter and the target team is the subreddit
+    the comment was left in. Both axes follow the order of teams.subreddit.
+    """
+
+    def __init__(self, buckets, team_names=None, sums=None):
+        self.buckets = [str(b) for b in buckets]
+        self.teams = list(default_registry().teams.subreddit.values) if team_names is None else list(team_names)
+        self.bucket2id = dict(zip(self.buckets, range(len(self.buckets))))
+        self.team2id = dict(zip(self.teams, range(len(self.teams))))
+
+        if sums is None:
+            sums = np.zeros((len(self.buckets), len(self.teams), len(self.teams), len(METRICS)))
+        self.sums = sums
+
+    def add(self, bucket, source, edge_sums):
+        """
+        Add per-target sums from aggregate_edge_sums for one source team and bucket.
+        """
+        edge_sums = edge_sums[edge_sums.index.isin(self.teams)]
+        itarget = [self.team2id[t] for t in edge_sums.index]
+        # Sums of an empty bucket file come back as object dtype
+        self.sums[self.bucket2id[str(bucket)], self.team2id[source], itarget] += edge_sums[METRICS].values.astype(float)
+
+    def merge(self, other):
+        """
+        Add the sums of another cube over the same teams. Buckets missing here are appended.
+        """
+        for b in other.buckets:
+            if b not in self.bucket2id:
+                self.bucket2id[b] = len(self.buckets)
+                self.buckets.append(b)
+
+        # Copy out of a read-only memory map before writing
+        pad = np.zeros((len(self.buckets) - len(self.sums),) + self.sums.shape[1:])
+        self.sums = np.concatenate([self.sums, pad])
+
+        ibucket = [self.bucket2id[b] for b in other.buckets]
+        self.sums[ibucket] += other.sums
+        return self
+
+    def save(self, path):
+        """
+        Save the cube as <path>.npy, memory-mappable with np.load, and labels as <path>.json.
+        """
+        np.save(path + '.npy', self.sums)
+        with open(path + '.json', 'w') as f:
+            json.dump(dict(buckets=self.buckets, teams=self.teams, metrics=METRICS), f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a saved cube. By default the sums are memory-mapped rather than read into memory.
+        """
+        with open(path + '.json', 'r') as f:
+            labels = json.load(f)
+        return cls(labels['buckets'], labels['teams'], np.load(path + '.npy', mmap_mode=mmap_mode))
+
+    def select(self, buckets=None):
+        """
+        Raw sums for the requested buckets, shape (n_buckets, n_teams, n_teams, n_metrics).
+        """
+        if buckets is None:
+            return np.asarray(self.sums)
+        return np.asarray(self.sums[[self.bucket2id[str(b)] for b in buckets]])
+
+    def edges(self, buckets=None, combine=False):
+        """
+        Normalized edge metrics, matching the tuples returned by get_sub_edges.
+
+        Args:
+        - buckets (list): Buckets to include. Defaults to all buckets.
+        - combine (bool): Sum the raw counts over the buckets first, e.g. to treat a week range as one window.
+
+        Returns:
+        - edges (np.ndarray): (..., source, target, 4) array of volume, sentiment, controversiality and score.
+        - valid (np.ndarray): (..., source, target) mask of edges get_sub_edges would return.
+        """
+        sums = self.select(buckets)
+        if combine:
+            sums = sums.sum(axis=0)
+        return normalize_sums(sums)
+
+    def edge_list(self, buckets=None):
+        """
+        Normalized edge tuples over the buckets taken as one window, in the format of get_sub_edges.
+        """
+        edges, valid = self.edges(buckets, combine=True)
+        return [(self.teams[s], self.teams[t], *edges[s, t]) for s, t in zip(*np.nonzero(valid))]
+
+    def summary(self, buckets=None, combine=True):
+        """
+        Incoming, outgoing and self summaries for every team.
+
+        Args:
+        - buckets (list): Buckets to include. Defaults to all buckets.
+        - combine (bool): If True, summarize the buckets as one window. Otherwise summarize each bucket.
+
+        Returns:
+        - summary (np.ndarray): (..., team, 9) array with the columns in SUMMARY_COLUMNS.
+        """
+        edges, valid = self.edges(buckets, combine)
+        return summarize_edges(edges, valid)
+
+    def summary_stats(self, buckets=None):
+        """
+        Summary table in the layout of summary_stats_in_<phase>.csv, treating the buckets as one window.
+        """
+        df = pd.DataFrame(self.summary(buckets), columns=SUMMARY_COLUMNS)
+        df['team'] = self.teams
+        return df
+
+
+def normalize_sums(sums):
+    """
+    Normalize raw (..., source, target, metric) sums the way get_sub_edges does.
+    """
+    count = sums[..., 0]
+    idx = np.arange(count.shape[-1])
+    selfcount = count[..., idx, idx][..., None]  # volume on the source team's own subreddit
+    selfscore = sums[..., idx, idx, 3][..., None]  # total score on the source team's own subreddit
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edges = np.stack([
+            count / selfcount,
+            sums[..., 1] / count,
+            sums[..., 2] / count,
+            sums[..., 3] / (count * selfscore),
+        ], axis=-1)
+
+    # Score is normalized by the source's total score on its own subreddit. Where that is 0
+    # the score edges are NaN on purpose rather than inf
+    edges[..., 3] = np.where(selfscore != 0, edges[..., 3], np.nan)
+
+    # get_sub_edges only emits edges that were seen, and none for teams without self comments
+    valid = (count > 0) & (selfcount > 0)
+    return edges, valid
+
+
+def summarize_edges(edges, valid):
+    """
+    Reduce normalized edges to per-team summaries, as in the summary cell of process_data.ipynb.
+
+    Incoming and outgoing metrics are sums over the other teams divided by the number of
+    teams, and self_sent is the sentiment of the team's own edge. Scores from teams without
+    a score normalization (NaN) are left out of incoming sums and make outgoing sums NaN.
+    """
+    n_teams = valid.shape[-1]
+    idx = np.arange(n_teams)
+    offdiag = valid & ~np.eye(n_teams, dtype=bool)
+
+    e = np.where(offdiag[..., None], edges, 0.)
+    incoming = np.nansum(e, axis=-3) / n_teams
+    outgoing = e.sum(axis=-2) / n_teams
+    self_sent = np.where(valid[..., idx, idx], edges[..., idx, idx, 1], np.nan)
+
+    # Interleave to in_weight, out_weight, in_sent, out_sent, ...
+    inout = np.stack([incoming, outgoing], axis=-1).reshape(incoming.shape[:-1] + (8,))
+    return np.concatenate([inout, self_sent[..., None]], axis=-1)
+
+
+def build_cube(bucket_dirs, sublist=None, report=None):
+    """
+    Build a cube from folders of per-team comment files, one folder per time bucket.
+
+    Args:
+    - bucket_dirs (dict): Maps a bucket label to a folder with one comments file or store folder per team,
+                          e.g. {'3': 'data/nfl_nonzero/weeks/3/comments'}.
+    - sublist (list): Team subreddits to include. Defaults to all teams.
+    - report (RunReport): Optional run report to record timings and row counts in.
+
+    Returns:
+    - cube (InteractionCube): Raw sums for every bucket.
+    """
+    cube = InteractionCube(list(bucket_dirs), sublist)
+    record = start_stage(report, 'build_cube', buckets=len(bucket_dirs))
+    n_read = 0
+
+    for bucket, folder in bucket_dirs.items():
+        for team in cube.teams:
+            filename = '{}/{}'.format(folder, team)
+            if not is_store(filename):
+                filename += '.csv'
+            try:
+                coms = read_coms(filename, columns=['subreddit', 'sentiment', 'controversiality', 'score'])
+            except FileNotFoundError:
+                continue
+
+            n_read += len(coms)
+            valid = coms.subreddit.notna()
+            record.drop('missing_fields', len(coms) - int(valid.sum()))
+            coms = coms[valid]
+            coms.subreddit = coms.subreddit.str.lower()
+            inside = coms.subreddit.isin(cube.teams)
+            record.drop('outside_sublist', len(coms) - int(inside.sum()))
+            cube.add(bucket, team, aggregate_edge_sums(coms[inside]))
+
+    record.finish(rows_in=n_read, rows_out=int(cube.sums[..., 0].sum()))
+    return cube
@@ -0,0 +1,150 @@
+"""
+Score every comment once across all team comment files.
+
+A commenter active in several team subreddits is scraped once per subreddit, so the same
+comment appears in several data/<group>/comments/<team>.csv files. This builds one scored
+store keyed by comment_keys that process_coms joins against instead of rescoring, and
+reports how much of the scoring work was duplicated.
+
+    python dedup.py data/nfl/comments/*.csv --out data/nfl_nonzero/scored.npz --workers 8
+"""
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from sentiment import score_comments, analyzer_version
+from utils import read_coms, comment_keys, resolve_author_flairs
+from registry import default_registry
+
+parser = argparse.ArgumentParser()
+parser.add_argument('files', nargs='+', help='Raw comment CSV files or store folders')
+parser.add_argument('--out', type=str, required=True, help='Scored store to write (.npz)')
+parser.add_argument('--workers', type=int, default=None)
+parser.add_argument('--chunk_size', type=int, default=5000)
+parser.add_argument('--backend', type=str, default='vader')
+
+
+class ScoredComments:
+    """
+    Sentiment of unique comments, keyed by the comment_keys hash of (author, created_utc, body).
+
+    Keys are kept sorted so a batch of comments is looked up with one binary search.
+    Lookups are counted in hits and misses.
+    """
+
+    def __init__(self, keys, sentiment, version):
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.sentiment = sentiment[order]
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def build(cls, filenames, n_workers=None, chunk_size=5000, backend='vader'):
+        """
+        Score the unique comments of many files.
+
+        Only comments process_coms scores are kept: comments with an author, body and flair, left
+        in /r/nfl or a team subreddit by an author whose /r/nfl flair is the file's team. Each file
+        is scored in turn, skipping comments already seen in earlier files and scoring repeated
+        bodies once.
+
+        Args:
+        - filenames (list): Raw comment CSV files or store folders.
+        - n_workers (int): Number of processes used for sentiment scoring. Defaults to the number of CPUs.
+        - chunk_size (int): Number of comments scored per worker task.
+        - backend (str): Sentiment scorer, 'vader' or 'numpy'.
+
+        Returns:
+        - scored (ScoredComments): Sentiment of every unique comment.
+        - report (dict): Comment, unique comment and unique body counts, the comments process_coms
+          would score file by file (baseline_scored) against those scored here (dedup_scored), and
+          the fraction of scoring saved.
+        """
+        registry = default_registry()
+        keys, sentiment = [np.array([], dtype=np.uint64)], [np.array([])]
+        seen = np.array([], dtype=np.uint64)
+        report = dict(files=0, comments=0, unique_comments=0, unique_bodies=0)
+
+        for filename in filenames:
+            coms = read_coms(filename, columns=['author', 'created_utc', 'body', 'subreddit', 'author_flair_text'])
+            coms = coms.dropna(subset=['author', 'body', 'author_flair_text'])
+
+            # The filters of process_coms: authors flaired with the file's team, in NFL subreddits
+            subname = filename.rstrip('/').split('/')[-1].split('.')[0]
+            coms = coms.assign(subreddit=coms.subreddit.str.lower())
+            author2team = resolve_author_flairs(coms)
+            flaired = coms.author.map(author2team) == subname
+            coms = coms[flaired.values & (registry.codes(registry.encode_subreddits(coms.subreddit)) >= 0)]
+
+            # Keep the first occurrence of each comment not scored in an earlier file
+            k = comment_keys(coms)
+            new = ~np.isin(k, seen) & ~pd.Series(k).duplicated().values
+            body_ids, bodies = pd.factorize(coms.body.values[new])
+
+            scores = score_comments(bodies, n_workers=n_workers, chunk_size=chunk_size, backend=backend)
+            keys.append(k[new])
+            sentiment.append(scores[body_ids])
+            seen = np.union1d(seen, k[new])
+
+            report['files'] += 1
+            report['comments'] += len(coms)
+            report['unique_comments'] += int(new.sum())
+            report['unique_bodies'] += len(bodies)
+            print(filename, len(coms), int(new.sum()))
+
+        n = max(report['comments'], 1)
+        report['baseline_scored'] = report['comments']
+        report['dedup_scored'] = report['unique_bodies']
+        report['duplicate_fraction'] = 1 - report['unique_comments'] / n
+        report['scoring_saved'] = 1 - report['unique_bodies'] / n
+
+        return cls(np.concatenate(keys), np.concatenate(sentiment), analyzer_version(backend)), report
+
+    def save(self, path):
+        np.savez(path, keys=self.keys, sentiment=self.sentiment, version=self.version)
+
+    @classmethod
+    def load(cls, path, backend=None):
+        """
+        Read a store written by save. If backend is given, raise ValueError unless the store was scored with it.
+        """
+        d = np.load(path)
+        scored = cls(d['keys'], d['sentiment'], str(d['version']))
+        if backend is not None:
+            scored.check_backend(backend)
+        return scored
+
+    def check_backend(self, backend):
+        """
+        Raise ValueError if the store was scored by another analyzer than backend.
+        """
+        if self.version != analyzer_version(backend):
+            raise ValueError('Scored store was built with {}, not {}'.format(self.version, analyzer_version(backend)))
+
+    def lookup(self, keys, backend=None):
+        """
+        Stored sentiment for each key, NaN for comments not in the store.
+
+        If backend is given, raise ValueError unless the store was scored with it.
+        """
+        if backend is not None:
+            self.check_backend(backend)
+        if len(self.keys) == 0:
+            self.misses += len(keys)
+            return np.full(len(keys), np.nan)
+        idx = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[idx] == keys
+        self.hits += int(found.sum())
+        self.misses += len(keys) - int(found.sum())
+        return np.where(found, self.sentiment[idx], np.nan)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    scored, report = ScoredComments.build(args.files, n_workers=args.workers, chunk_size=args.chunk_size,
+                                          backend=args.backend)
+    scored.save(args.out)
+    print(json.dumps(report, indent=1))
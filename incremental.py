@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import pandas as pd
+from cube import InteractionCube, METRICS
+from utils import (PHASE_WINDOWS, nfl_week_boundaries, parse_comment_dates, assign_buckets,
+                   comment_keys)
+
+
+class IncrementalSummaries:
+    """
+    Weekly and per-phase edge sums that can be updated with newly scraped comments.
+
+    The state is an InteractionCube with one bucket per week and per phase, plus the keys
+    of every comment already folded in. Both are saved under path, so a daily refresh
+    only needs to process the new comments.
+
+    Parameters:
+    - path (str): State folder, e.g. 'data/nfl_nonzero/incremental'.
+    - week_bounds (list): Sorted week boundaries. Defaults to nfl_week_boundaries().
+    - phase_windows (dict): (start, stop) date strings for each season phase.
+    """
+
+    def __init__(self, path, week_bounds=None, phase_windows=PHASE_WINDOWS):
+        self.path = path
+        self.week_bounds = nfl_week_boundaries() if week_bounds is None else week_bounds
+        self.phase_windows = phase_windows
+        self.weeks = [str(week) for week in range(len(self.week_bounds) - 1)]
+
+        if os.path.exists(os.path.join(path, 'cube.npy')):
+            self.cube = InteractionCube.load(os.path.join(path, 'cube'), mmap_mode=None)
+            self.seen = np.load(os.path.join(path, 'seen.npy'))
+        else:
+            self.cube = InteractionCube(self.weeks + list(phase_windows))
+            self.seen = np.array([], dtype=np.uint64)
+
+    def update(self, coms):
+        """
+        Fold processed comments into the sums, skipping comments seen before.
+
+        Args:
+        - coms (pd.DataFrame): Processed comments with 'flair' (source team), 'subreddit' (target team),
+                               'created_utc', 'sentiment', 'controversiality' and 'score' columns.
+
+        Returns:
+        - affected (list): Buckets whose sums changed.
+        """
+        coms = coms.dropna(subset=['author', 'body', 'author_flair_text', 'subreddit'])
+        keys = comment_keys(coms)
+
+        # Drop comments already folded in, and repeats within the batch
+        new = ~np.isin(keys, self.seen)
+        new &= ~pd.Series(keys).duplicated().values
+        coms = coms[new]
+        self.seen = np.union1d(self.seen, keys[new])
+
+        subreddit = coms.subreddit.str.lower()
+        inside = subreddit.isin(self.cube.team2id).values & coms.flair.isin(self.cube.team2id).values
+        coms = coms[inside]
+        isource = coms.flair.map(self.cube.team2id).values
+        itarget = subreddit[inside].map(self.cube.team2id).values
+        values = np.column_stack([np.ones(len(coms))] + [coms[m].values.astype(float) for m in METRICS[1:]])
+
+        dates = parse_comment_dates(coms)
+        buckets = [(self.weeks, assign_buckets(dates, self.week_bounds))]
+        for phase, (start, stop) in self.phase_windows.items():
+            buckets.append(([phase], np.where((dates >= start) & (dates < stop), 0, -1)))
+
+        affected = []
+        for labels, ibucket in buckets:
+            mask = ibucket >= 0
+            ids = np.array([self.cube.bucket2id[label] for label in labels])[ibucket[mask]]
+            np.add.at(self.cube.sums, (ids, isource[mask], itarget[mask]), values[mask])
+            affected.extend(str(labels[i]) for i in np.unique(ibucket[mask]))
+
+        return affected
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.cube.save(os.path.join(self.path, 'cube'))
+        np.save(os.path.join(self.path, 'seen.npy'), self.seen)
+
+    def write_summaries(self, buckets, outdir='data/summary_by_week'):
+        """
+        Recompute and write summary_stats_<bucket>.csv for the given buckets only.
+        """
+        for bucket in buckets:
+            self.cube.summary_stats([bucket]).to_csv(os.path.join(outdir, 'summary_stats_{}.csv'.format(bucket)), index=False)
+
+    def edges(self, bucket):
+        """
+        Normalized edge tuples for one bucket, in the format of get_sub_edges.
+        """
+        return self.cube.edge_list([bucket])
@@ -0,0 +1,169 @@
+"""
+Per-stage instrumentation and run reports.
+
+Stages call start_stage(report, ...) and finish the returned record with their row counts.
+Each finished record is appended as one JSON line to the report file: wall and CPU time,
+rows in and out, rows dropped by each filter, growth of the process's peak memory and
+cache hit rates. With no
+report the record does nothing, so instrumented functions cost nothing extra by default.
+
+Summarize a run report, slowest stages first:
+
+    python instrument.py data/nfl_nonzero/run_report.jsonl
+"""
+import os
+import json
+import time
+import uuid
+import resource
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+
+parser = argparse.ArgumentParser()
+parser.add_argument('report', type=str, help='Run report JSONL file')
+parser.add_argument('--run', type=str, default=None, help='Run id to summarize. Defaults to the last run')
+
+
+def _max_rss_mb():
+    # High-water mark of the process so far (ru_maxrss is in kilobytes on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _cpu_seconds():
+    # This process plus finished children, e.g. sentiment pool workers
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class RunReport:
+    """
+    Append-only JSONL report shared by every stage of a run.
+
+    Records are written with a single append each, so worker processes of the same run can
+    share one report file.
+
+    Parameters:
+    - path (str): Report file. Records of earlier runs are kept.
+    - run_id (str): Identifier stored in every record. Defaults to a new random id.
+    """
+
+    def __init__(self, path, run_id=None):
+        self.path = path
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+
+    def write(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=_to_json) + '\n')
+
+
+class StageRecord:
+    """
+    Measurements of one stage run, written to the report by finish.
+    """
+
+    def __init__(self, report, stage, **fields):
+        self.report = report
+        self.fields = dict(run=report.run_id, stage=stage, pid=os.getpid(),
+                           start=datetime.datetime.now().isoformat(timespec='seconds'), dropped=dict())
+        self.fields.update(fields)
+        self.wall0 = time.perf_counter()
+        self.cpu0 = _cpu_seconds()
+        self.rss0 = _max_rss_mb()
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def drop(self, reason, n):
+        """
+        Count rows removed by a filter.
+        """
+        self.fields['dropped'][reason] = self.fields['dropped'].get(reason, 0) + int(n)
+
+    def hit_rate(self, name, hits, misses):
+        total = hits + misses
+        self.fields[name] = dict(hits=int(hits), misses=int(misses), rate=hits / total if total else None)
+
+    def finish(self, **fields):
+        self.fields.update(fields)
+        self.fields['wall_s'] = time.perf_counter() - self.wall0
+        self.fields['cpu_s'] = _cpu_seconds() - self.cpu0
+        # How far the stage raised the process's peak RSS, in MB. The peak itself would repeat an
+        # earlier stage's peak, and a stage staying below it grows the peak by 0
+        self.fields['rss_growth_mb'] = _max_rss_mb() - self.rss0
+        self.report.write(self.fields)
+        return self.fields
+
+
+class NullRecord:
+    """
+    Stand-in record when no report is collected.
+    """
+
+    def set(self, **fields):
+        pass
+
+    def drop(self, reason, n):
+        pass
+
+    def hit_rate(self, name, hits, misses):
+        pass
+
+    def finish(self, **fields):
+        return None
+
+
+def start_stage(report, stage, **fields):
+    """
+    Start measuring a stage.
+
+    Args:
+    - report (RunReport): Report to write to, or None to skip instrumentation.
+    - stage (str): Stage name, e.g. 'process_coms'.
+    - **fields: Extra fields for the record, such as team.
+
+    Returns:
+    - record (StageRecord or NullRecord): Call record.finish(rows_out=...) when the stage is done.
+    """
+    if report is None:
+        return NullRecord()
+    return StageRecord(report, stage, **fields)
+
+
+def _to_json(value):
+    # NumPy scalars in row counts and metadata
+    return value.item() if isinstance(value, np.generic) else str(value)
+
+
+def read_report(path, run=None):
+    """
+    Records of one run as a DataFrame. Defaults to the last run in the file.
+    """
+    with open(path, 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    df = pd.DataFrame(records)
+    run = df.run.iloc[-1] if run is None else run
+    return df[df.run == run]
+
+
+def summarize(records):
+    """
+    Total time, rows and drops per stage, slowest stage first.
+    """
+    dropped = pd.DataFrame(list(records.dropped)).fillna(0).add_prefix('dropped_')
+    df = pd.concat([records.reset_index(drop=True), dropped], axis=1)
+
+    columns = ['wall_s', 'cpu_s'] + [c for c in ['rows_in', 'rows_out'] if c in df] + list(dropped.columns)
+    summary = df.groupby('stage')[columns].sum(min_count=1)
+    summary['calls'] = df.groupby('stage').size()
+    summary['rss_growth_mb'] = df.groupby('stage').rss_growth_mb.max()
+    return summary.sort_values('wall_s', ascending=False)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    records = read_report(args.report, args.run)
+    print('run {}: {} records'.format(records.run.iloc[0], len(records)))
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(summarize(records))
@@ -0,0 +1,377 @@
+"""
+Command-line runner for the comment pipeline.
+
+Stages run in dependency order: scrape -> process -> partition -> cube -> bootstrap -> summaries -> plots.
+The cube stage builds the team interaction cube and writes each bucket's all_edges.pkl. The
+bootstrap stage computes confidence intervals that the summaries carry next to each metric.
+The summaries stage writes summary_stats_in_<phase>.csv and summary_by_week/ into <outdir>,
+and the plots stage runs the notebook on them.
+A task is skipped when the contents of its inputs, the code it runs and its parameters
+match its last successful run, recorded in <outdir>/pipeline_state.json. Per-team tasks
+run across a process pool. Timings, row counts and drops of every stage and task are
+appended to <outdir>/run_report.jsonl (summarize with python instrument.py).
+
+    python pipeline.py                                     # rebuild whatever is stale
+    python pipeline.py --stages process partition --teams eagles falcons
+    python pipeline.py --stages scrape process --force scrape --Nposts 100 --Ncomments 500
+    python pipeline.py --dry_run                           # list stale tasks without running them
+"""
+import os
+import sys
+import json
+import pickle
+import hashlib
+import argparse
+import subprocess
+from functools import partial
+from multiprocessing import Pool
+import pandas as pd
+from utils import (process_coms, nfl_week_boundaries, PHASE_WINDOWS, write_team_partitions,
+                   write_partition_metadata)
+from cube import build_cube, InteractionCube
+from registry import default_registry
+from instrument import RunReport, start_stage, _to_json
+from bootstrap import bootstrap_buckets, BootstrapIntervals
+
+STAGES = ['scrape', 'process', 'partition', 'cube', 'bootstrap', 'summaries', 'plots']
+DEFAULT_STAGES = ['process', 'partition', 'cube', 'bootstrap', 'summaries']
+
+# Source files whose contents version each stage
+CODE = dict(
+    scrape=['scrape.py'],
+    process=['utils.py', 'sentiment.py', 'vader_batch.py', 'registry.py', 'storage.py', 'dedup.py'],
+    partition=['utils.py', 'registry.py', 'storage.py'],
+    cube=['cube.py', 'utils.py', 'registry.py', 'storage.py'],
+    bootstrap=['bootstrap.py', 'cube.py', 'utils.py', 'registry.py', 'storage.py'],
+    summaries=['cube.py', 'bootstrap.py'],
+    plots=['plotting_notebook.ipynb'],
+)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--stages', nargs='+', choices=STAGES, default=DEFAULT_STAGES)
+parser.add_argument('--teams', nargs='+', default=None, help='Team subreddits. Defaults to all teams')
+parser.add_argument('--force', nargs='*', choices=STAGES, default=[], help='Rerun these stages even if up to date')
+parser.add_argument('--dry_run', action='store_true')
+parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+parser.add_argument('--group', type=str, default='nfl', help='Raw comments are read from data/<group>/comments')
+parser.add_argument('--tag', type=str, default='_nonzero', help='Outputs go to data/<group><tag>')
+parser.add_argument('--no_zero_sentiment', action=argparse.BooleanOptionalAction, default=True)
+parser.add_argument('--backend', type=str, default='vader', help='Sentiment scorer, vader or numpy')
+parser.add_argument('--scored', type=str, default=None, help='Scored store built by dedup.py')
+parser.add_argument('--first_start', type=str, default='2021-03-01')
+parser.add_argument('--season_start', type=str, default='2022-09-08')
+parser.add_argument('--n_weeks', type=int, default=25)
+parser.add_argument('--n_boot', type=int, default=1000, help='Bootstrap replicates for the confidence intervals')
+parser.add_argument('--boot_seed', type=int, default=0)
+parser.add_argument('--alpha', type=float, default=0.05, help='Confidence intervals cover 1 - alpha')
+parser.add_argument('--Nposts', type=int, default=100)
+parser.add_argument('--Ncomments', type=int, default=100)
+
+
+class Task:
+    """
+    One unit of pipeline work: a module-level function and its arguments, plus the files it
+    reads and writes and the parameters that change its outputs.
+    """
+
+    def __init__(self, name, stage, func, args, inputs, outputs, params=None):
+        self.name = name
+        self.stage = stage
+        self.func = func
+        self.args = args
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or dict()
+
+
+class PipelineState:
+    """
+    Fingerprints of the last successful run of every task, saved as JSON.
+
+    File contents are hashed, so a file rewritten with the same bytes does not make its
+    readers stale. Digests are cached by size and modification time to avoid rehashing
+    unchanged files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tasks, self.files = dict(), dict()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            self.tasks, self.files = state['tasks'], state['files']
+
+    def file_digest(self, path):
+        if not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        cached = self.files.get(path)
+        if cached is not None and cached[:2] == [st.st_size, st.st_mtime_ns]:
+            return cached[2]
+
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.files[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def fingerprint(self, task):
+        here = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha1()
+        for path in CODE[task.stage]:
+            h.update('{}={}\n'.format(path, self.file_digest(os.path.join(here, path))).encode())
+        for path in sorted(task.inputs):
+            h.update('{}={}\n'.format(path, self.file_digest(path)).encode())
+        h.update(json.dumps(task.params, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def is_stale(self, task):
+        return (self.tasks.get(task.name) != self.fingerprint(task)
+                or not all(os.path.exists(path) for path in task.outputs))
+
+    def record(self, task):
+        self.tasks[task.name] = self.fingerprint(task)
+        self.save()
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(tasks=self.tasks, files=self.files), f)
+        os.replace(tmp, self.path)
+
+
+def run_scrape(team, group, Nposts, Ncomments, report=None):
+    here = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, os.path.join(here, 'scrape.py'), '--subreddit', team, '--group', group,
+           '--Nposts', str(Nposts), '--Ncomments', str(Ncomments)]
+    if report is not None:
+        cmd += ['--report', report.path, '--run_id', report.run_id]
+    return subprocess.run(cmd).returncode == 0
+
+
+def run_process(filename, outfile, metafile, no_zero_sentiment, backend, scored, report=None):
+    if scored is not None:
+        from dedup import ScoredComments
+        scored = ScoredComments.load(scored, backend=backend)
+
+    # Scoring stays in this worker: pool workers cannot start pools of their own
+    coms, meta = process_coms(filename, no_zero_sentiment, n_workers=1, backend=backend, scored=scored,
+                              report=report)
+    if meta is None:
+        return False
+    coms.to_csv(outfile)
+    with open(metafile, 'w') as f:
+        json.dump(meta, f, default=_to_json)
+    return True
+
+
+def run_partition(filename, outdir, metafile, week_bounds, phase_windows, report=None):
+    metadata = write_team_partitions(filename, outdir, week_bounds, phase_windows, report=report)
+    with open(metafile, 'w') as f:
+        json.dump(metadata, f, default=_to_json)
+    return True
+
+
+def run_cube(bucket_dirs, outdir, n_workers, report=None):
+    # Buckets are independent, so each is built in its own process and the cubes are summed
+    with Pool(n_workers) as pool:
+        parts = pool.map(partial(build_cube, report=report), [{bucket: folder} for bucket, folder in bucket_dirs.items()])
+
+    cube = InteractionCube(list(bucket_dirs))
+    for part in parts:
+        cube.merge(part)
+    cube.save(os.path.join(outdir, 'cube'))
+
+    for bucket, folder in bucket_dirs.items():
+        os.makedirs(os.path.dirname(folder), exist_ok=True)
+        with open(os.path.join(os.path.dirname(folder), 'all_edges.pkl'), 'wb') as f:
+            pickle.dump(cube.edge_list([bucket]), f)
+    return True
+
+
+def run_bootstrap(bucket_dirs, outfile, n_boot, seed, alpha, n_workers, report=None):
+    ci = bootstrap_buckets(bucket_dirs, n_boot, seed, alpha, n_workers, report=report)
+    ci.save(outfile)
+    return True
+
+
+def run_summaries(cubefile, outdir, phases, weeks, cifile=None):
+    cube = InteractionCube.load(cubefile)
+    os.makedirs(os.path.join(outdir, 'summary_by_week'), exist_ok=True)
+
+    # Confidence intervals go next to each metric when the bootstrap stage has run
+    ci = BootstrapIntervals.load(cifile) if cifile is not None and os.path.exists(cifile) else None
+    summary_stats = lambda bucket: ci.add_to_summary(cube.summary_stats([bucket]), bucket) if ci else cube.summary_stats([bucket])
+
+    for version in phases:
+        df = summary_stats(version)
+        df.to_csv('{}/summary_stats_in_{}.csv'.format(outdir, version), index=False)
+        with open('{}/summary_dict_in_{}.pkl'.format(outdir, version), 'wb') as f:
+            pickle.dump(df.set_index('team').to_dict(orient='index'), f)
+
+    for week in weeks:
+        summary_stats(week).to_csv('{}/summary_by_week/summary_stats_{}.csv'.format(outdir, week), index=False)
+    return True
+
+
+def run_plots(notebook, outdir):
+    # The notebook reads the summaries and cube of this run's output folder
+    cmd = [sys.executable, '-m', 'jupyter', 'nbconvert', '--to', 'notebook', '--execute', '--inplace', notebook]
+    return subprocess.run(cmd, env=dict(os.environ, PIPELINE_OUTDIR=outdir)).returncode == 0
+
+
+def _run_task(task):
+    try:
+        return task.name, task.func(*task.args)
+    except Exception as e:
+        print('{} failed: {!r}'.format(task.name, e))
+        return task.name, False
+
+
+def stage_tasks(stage, args, teams, report=None):
+    """
+    Tasks of one stage, with the paths and parameters their fingerprints depend on.
+    The run report is passed to each task but is not part of its fingerprint.
+    """
+    raw = 'data/{}/comments'.format(args.group)
+    outdir = 'data/{}{}'.format(args.group, args.tag)
+    week_bounds = nfl_week_boundaries(args.first_start, args.season_start, args.n_weeks)
+    weeks = [str(week) for week in range(len(week_bounds) - 1)]
+    folders = ['weeks/{}'.format(week) for week in weeks] + list(PHASE_WINDOWS)
+    bucket_dirs = {bucket: '{}/{}/comments'.format(outdir, folder) for bucket, folder in zip(weeks + list(PHASE_WINDOWS), folders)}
+
+    if stage == 'scrape':
+        return [Task('scrape/' + team, stage, run_scrape, (team, args.group, args.Nposts, args.Ncomments, report),
+                     [], ['{}/{}.csv'.format(raw, team)], dict(Nposts=args.Nposts, Ncomments=args.Ncomments))
+                for team in teams]
+
+    if stage == 'process':
+        params = dict(no_zero_sentiment=args.no_zero_sentiment, backend=args.backend)
+        return [Task('process/' + team, stage, run_process,
+                     ('{}/{}.csv'.format(raw, team), '{}/processed/comments/{}.csv'.format(outdir, team),
+                      '{}/processed/meta/{}.json'.format(outdir, team), args.no_zero_sentiment, args.backend, args.scored,
+                      report),
+                     ['{}/{}.csv'.format(raw, team)] + ([args.scored] if args.scored else []),
+                     ['{}/processed/comments/{}.csv'.format(outdir, team), '{}/processed/meta/{}.json'.format(outdir, team)],
+                     params)
+                for team in teams]
+
+    if stage == 'partition':
+        params = dict(week_bounds=week_bounds, phase_windows=PHASE_WINDOWS)
+        return [Task('partition/' + team, stage, run_partition,
+                     ('{}/processed/comments/{}.csv'.format(outdir, team), outdir,
+                      '{}/partition_meta/{}.json'.format(outdir, team), week_bounds, PHASE_WINDOWS, report),
+                     ['{}/processed/comments/{}.csv'.format(outdir, team)],
+                     ['{}/partition_meta/{}.json'.format(outdir, team)]
+                     + ['{}/{}/comments/{}.csv'.format(outdir, folder, team) for folder in folders],
+                     params)
+                for team in teams]
+
+    if stage == 'cube':
+        inputs = ['{}/{}.csv'.format(folder, team) for folder in bucket_dirs.values() for team in default_registry().teams.subreddit]
+        outputs = [outdir + '/cube.npy', outdir + '/cube.json'] + ['{}/{}/all_edges.pkl'.format(outdir, folder) for folder in folders]
+        return [Task('cube', stage, run_cube, (bucket_dirs, outdir, args.workers, report), inputs, outputs)]
+
+    if stage == 'bootstrap':
+        inputs = ['{}/{}.csv'.format(folder, team) for folder in bucket_dirs.values() for team in default_registry().teams.subreddit]
+        params = dict(n_boot=args.n_boot, seed=args.boot_seed, alpha=args.alpha)
+        return [Task('bootstrap', stage, run_bootstrap,
+                     (bucket_dirs, outdir + '/bootstrap.npz', args.n_boot, args.boot_seed, args.alpha, args.workers, report),
+                     inputs, [outdir + '/bootstrap.npz'], params)]
+
+    summaries = ['{}/summary_stats_in_{}.csv'.format(outdir, v) for v in PHASE_WINDOWS] + \
+                ['{}/summary_dict_in_{}.pkl'.format(outdir, v) for v in PHASE_WINDOWS] + \
+                ['{}/summary_by_week/summary_stats_{}.csv'.format(outdir, week) for week in weeks]
+
+    if stage == 'summaries':
+        return [Task('summaries', stage, run_summaries, (outdir + '/cube', outdir, list(PHASE_WINDOWS), weeks, outdir + '/bootstrap.npz'),
+                     [outdir + '/cube.npy', outdir + '/cube.json', outdir + '/bootstrap.npz'], summaries)]
+
+    if stage == 'plots':
+        return [Task('plots', stage, run_plots, ('plotting_notebook.ipynb', outdir),
+                     summaries + [outdir + '/cube.npy', outdir + '/cube.json'], [])]
+
+
+def finish_stage(stage, args, teams):
+    """
+    Combine per-team metadata written by the process and partition stages.
+    """
+    outdir = 'data/{}{}'.format(args.group, args.tag)
+    if stage == 'process':
+        metadata = dict()
+        for team in teams:
+            metafile = '{}/processed/meta/{}.json'.format(outdir, team)
+            if not os.path.exists(metafile):
+                continue
+            with open(metafile, 'r') as f:
+                for key, value in json.load(f).items():
+                    metadata.setdefault(key, []).extend(value)
+        pd.DataFrame(metadata).to_csv('{}/processed/metadata.csv'.format(outdir))
+
+    if stage == 'partition':
+        team_metadata = []
+        for team in teams:
+            metafile = '{}/partition_meta/{}.json'.format(outdir, team)
+            if os.path.exists(metafile):
+                with open(metafile, 'r') as f:
+                    team_metadata.append(json.load(f))
+        write_partition_metadata(team_metadata, outdir)
+
+
+def run_pipeline(args):
+    teams = args.teams or list(default_registry().teams.subreddit)
+    outdir = 'data/{}{}'.format(args.group, args.tag)
+    if not args.dry_run:
+        for folder in ['processed/comments', 'processed/meta', 'partition_meta']:
+            os.makedirs('{}/{}'.format(outdir, folder), exist_ok=True)
+
+    state = PipelineState(os.path.join(outdir, 'pipeline_state.json'))
+    report = None if args.dry_run else RunReport(os.path.join(outdir, 'run_report.jsonl'))
+    state.save = (lambda: None) if args.dry_run else state.save
+    pending = set()  # outputs of stale tasks, for dry runs
+    failed = set()  # outputs of failed tasks, whose readers are skipped
+
+    for stage in [s for s in STAGES if s in args.stages]:
+        tasks = stage_tasks(stage, args, teams, report)
+        blocked = [t for t in tasks if failed.intersection(t.inputs)]
+        for task in blocked:
+            print('{} skipped: an input failed to build'.format(task.name))
+            failed.update(task.outputs)
+
+        tasks = [t for t in tasks if t not in blocked]
+        stale = [t for t in tasks if stage in args.force or state.is_stale(t) or pending.intersection(t.inputs)]
+        print('{}: {} of {} tasks stale'.format(stage, len(stale), len(tasks)))
+
+        if args.dry_run:
+            for task in stale:
+                print('  ' + task.name)
+                pending.update(task.outputs)
+            continue
+        if not stale:
+            continue
+
+        record = start_stage(report, 'pipeline/' + stage, tasks=len(stale))
+        # Scrapes share one API rate limit, and cube and later stages pool internally
+        if stage in ('process', 'partition') and args.workers > 1 and len(stale) > 1:
+            with Pool(min(args.workers, len(stale))) as pool:
+                results = dict(pool.imap_unordered(_run_task, stale))
+        else:
+            results = dict(_run_task(task) for task in stale)
+
+        for task in stale:
+            if results[task.name]:
+                state.record(task)
+            else:
+                print('{} did not complete'.format(task.name))
+                failed.update(task.outputs)
+                record.drop('failed_tasks', 1)
+
+        finish_stage(stage, args, teams)
+        record.finish(rows_out=sum(bool(results[t.name]) for t in stale))
+
+    state.save()
+
+
+if __name__ == "__main__":
+    run_pipeline(parser.parse_args())
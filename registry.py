@@ -0,0 +1,77 @@
+import os
+import functools
+import pandas as pd
+
+# nfl_subs.txt, nfl_flairs.txt and nfl_inits.txt live next to this module
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TeamRegistry:
+    """
+    Stable integer codes for /r/nfl and the 32 team subreddits.
+
+    Code 0 is /r/nfl and codes 1..32 follow the order of nfl_subs.txt. Subreddit and team
+    flair columns share this code space, so comments can be filtered by comparing int8 codes
+    instead of calling isin on strings.
+
+    Parameters:
+    - subs (list): Team subreddits.
+    - flairs (list): /r/nfl flair of each team.
+    - inits (list): Abbreviation of each team.
+    """
+
+    NFL = 0
+
+    def __init__(self, subs, flairs, inits):
+        self.teams = pd.DataFrame(dict(subreddit=subs, flair=flairs, inits=inits))
+        self.team2abbrev = dict(zip(self.teams.subreddit, self.teams.inits))
+        self.flair2team = dict(zip(self.teams.flair, self.teams.subreddit))
+
+        self.subreddits = ['nfl'] + list(subs)
+        self.sub2code = dict(zip(self.subreddits, range(len(self.subreddits))))
+        self.subreddit_dtype = pd.CategoricalDtype(self.subreddits)
+
+    @classmethod
+    def from_files(cls, subs_file='nfl_subs.txt', flairs_file='nfl_flairs.txt', inits_file='nfl_inits.txt'):
+        lists = []
+        for filename in (subs_file, flairs_file, inits_file):
+            with open(filename, 'r') as f:
+                lists.append([line.strip() for line in f.readlines()])
+        return cls(*lists)
+
+    def code(self, subreddit):
+        """
+        Integer code of a subreddit, -1 if it is not an NFL subreddit.
+        """
+        return self.sub2code.get(subreddit, -1)
+
+    def encode_subreddits(self, values):
+        """
+        Encode lowercase subreddit or team names as a categorical in the registry's code space.
+
+        Names outside /r/nfl and the team subreddits become NaN with code -1.
+        """
+        # Map names to codes first; pandas no longer accepts values outside the categories
+        codes = self.subreddit_dtype.categories.get_indexer(values)
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=self.subreddit_dtype), index=getattr(values, 'index', None))
+
+    def codes(self, values):
+        """
+        Integer codes of an encoded column, as a NumPy int8 array.
+        """
+        return values.cat.codes.values
+
+
+@functools.lru_cache(maxsize=None)
+def default_registry():
+    """
+    Registry read from the team lists in DATA_DIR on first use, then shared by the whole process.
+    """
+    return TeamRegistry.from_files(*[os.path.join(DATA_DIR, name) for name in ('nfl_subs.txt', 'nfl_flairs.txt', 'nfl_inits.txt')])
+
+
+def encode_authors(values):
+    """
+    Dictionary-encode author names. Codes are int32 once there are more than 32767 authors.
+    """
+    return values.astype('category')
@@ -0,0 +1,323 @@
+"""
+Batch rendering of rivalry graphs from precomputed edges.
+
+Edges come from the interaction cube (or the all_edges.pkl file of each bucket), so no
+comments are read. Every team subset gets one vertex layout, computed from its edges
+over all buckets and saved next to its frames, so vertices stay put from frame to frame.
+Frames are drawn across a process pool with graph-tool when it is installed and with
+matplotlib otherwise.
+
+    python render.py data/nfl_nonzero/cube --subsets nfceast nfcplayoffs --out plots/frames --workers 8
+    python render.py data/nfl_nonzero --subsets nfceast=eagles,nygiants,cowboys,commanders --buckets offseason regular playoffs
+"""
+import os
+import json
+import pickle
+import functools
+import argparse
+import importlib.util
+from multiprocessing import Pool
+import numpy as np
+from cube import InteractionCube
+from registry import default_registry
+from utils import PHASE_WINDOWS
+
+# Team subsets of the README figures
+SUBSETS = dict(
+    nfceast=['eagles', 'nygiants', 'cowboys', 'commanders'],
+    nfcplayoffs=['eagles', '49ers', 'minnesotavikings', 'buccaneers', 'cowboys', 'nygiants', 'seahawks'],
+)
+
+BACKENDS = ('auto', 'graph-tool', 'matplotlib')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('source', type=str, help='Saved cube path (without extension), or an output folder holding all_edges.pkl files')
+parser.add_argument('--subsets', nargs='+', default=list(SUBSETS), help='Names in SUBSETS or name=team,team,...')
+parser.add_argument('--buckets', nargs='+', default=None, help='Buckets to draw. Defaults to every bucket of the source')
+parser.add_argument('--out', type=str, default='plots/frames')
+parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+parser.add_argument('--backend', type=str, choices=BACKENDS, default='auto')
+parser.add_argument('--ink_scale', type=float, default=1.)
+parser.add_argument('--norm_scale', type=float, default=3.)
+parser.add_argument('--relayout', action='store_true', help='Recompute layouts saved by an earlier run')
+
+
+def load_edges(source, buckets=None):
+    """
+    Normalized edges of every bucket, from a saved cube or from all_edges.pkl files.
+
+    Args:
+    - source (str): Cube path as passed to InteractionCube.load, or an output folder such as
+                    'data/nfl_nonzero' with weeks/<week>/all_edges.pkl and <phase>/all_edges.pkl.
+    - buckets (list): Bucket labels. Defaults to all buckets of the cube, or weeks 0-24 and the phases.
+
+    Returns:
+    - buckets (list): Bucket labels.
+    - teams (list): Team subreddits, the order of the source and target axes.
+    - edges (np.ndarray): (bucket, source, target, 4) volume, sentiment, controversiality and score.
+    - valid (np.ndarray): (bucket, source, target) mask of edges present in the data.
+    """
+    if os.path.exists(source + '.json'):
+        cube = InteractionCube.load(source)
+        buckets = cube.buckets if buckets is None else [str(b) for b in buckets]
+        edges, valid = cube.edges(buckets)
+        return buckets, cube.teams, edges, valid
+
+    teams = list(default_registry().teams.subreddit)
+    team2id = dict(zip(teams, range(len(teams))))
+    if buckets is None:
+        buckets = [str(week) for week in range(25)] + list(PHASE_WINDOWS)
+    buckets = [str(b) for b in buckets]
+
+    edges = np.full((len(buckets), len(teams), len(teams), 4), np.nan)
+    valid = np.zeros(edges.shape[:-1], dtype=bool)
+    for ibucket, bucket in enumerate(buckets):
+        folder = bucket if bucket in PHASE_WINDOWS else 'weeks/' + bucket
+        with open(os.path.join(source, folder, 'all_edges.pkl'), 'rb') as f:
+            edge_list = pickle.load(f)
+        for source_team, target_team, *metrics in edge_list:
+            s, t = team2id[source_team], team2id[target_team]
+            edges[ibucket, s, t] = metrics
+            valid[ibucket, s, t] = True
+    return buckets, teams, edges, valid
+
+
+def spring_layout(weights, seed=0, iterations=200):
+    """
+    Force-directed (Fruchterman-Reingold) vertex positions for a small weighted graph.
+
+    Args:
+    - weights (np.ndarray): (n, n) edge weights. Direction is ignored and self loops do not count.
+    - seed (int): Seed of the initial positions. The same weights and seed give the same layout.
+    - iterations (int): Number of relaxation steps.
+
+    Returns:
+    - pos (np.ndarray): (n, 2) positions scaled to [-1, 1].
+    """
+    n = len(weights)
+    if n < 3:
+        return np.array([[-1., 0.], [1., 0.]])[:n]
+
+    w = weights + weights.T
+    np.fill_diagonal(w, 0.)
+    if w.max() > 0:
+        w = w / w.max()
+
+    # Start on a jittered circle so unconnected vertices stay spread out
+    rng = np.random.default_rng(seed)
+    angle = 2 * np.pi * np.arange(n) / n
+    pos = np.stack([np.cos(angle), np.sin(angle)], axis=1) + 0.05 * rng.standard_normal((n, 2))
+
+    k = 1 / np.sqrt(n)
+    for temperature in np.linspace(0.1, 0.001, iterations):
+        delta = pos[:, None] - pos[None]
+        dist = np.maximum(np.linalg.norm(delta, axis=-1), 1e-3)
+        # Repulsion between every pair, attraction along weighted edges
+        force = k ** 2 / dist ** 2 - (0.1 + w) * dist / k
+        np.fill_diagonal(force, 0.)
+        disp = (delta * force[..., None]).sum(axis=1)
+        length = np.maximum(np.linalg.norm(disp, axis=1, keepdims=True), 1e-9)
+        pos += disp / length * np.minimum(length, temperature)
+
+    pos -= pos.mean(axis=0)
+    return pos / np.abs(pos).max()
+
+
+def subset_layout(name, subset, edges, valid, out, relayout=False):
+    """
+    Layout of a team subset, computed from its mean edge volume over all buckets.
+
+    The layout is saved as <out>/<name>/layout.json and reused by later runs over the same
+    teams, so frames rendered at different times line up.
+    """
+    path = os.path.join(out, name, 'layout.json')
+    if not relayout and os.path.exists(path):
+        with open(path, 'r') as f:
+            saved = json.load(f)
+        if saved['teams'] == subset:
+            return np.array(saved['pos'])
+
+    volume = np.where(valid, edges[..., 0], 0.).mean(axis=0)
+    pos = spring_layout(volume)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(dict(teams=subset, pos=pos.tolist()), f)
+    return pos
+
+
+def subset_frames(name, subset, buckets, teams, edges, valid, out, norm_scale=3., relayout=False):
+    """
+    Drawing instructions for one team subset in every bucket.
+
+    As in utils.get_rivalry_graph, edge widths scale with normalized volume and edges are colored
+    by sentiment. Widths are relative to the largest volume between two different teams in the
+    frame, since a team's own edge always has volume 1 and would leave every other edge a
+    hairline; own edges are capped at norm_scale. The color scale is shared by all frames of
+    the subset and spans the 95th percentile of absolute sentiment.
+
+    Returns:
+    - frames (list): One dict per bucket, the argument of render_frame.
+    """
+    idx = [teams.index(team) for team in subset]
+    e = edges[:, idx][:, :, idx]
+    v = valid[:, idx][:, :, idx]
+    pos = subset_layout(name, subset, e, v, out, relayout)
+
+    team2abbrev = default_registry().team2abbrev
+    names = [team2abbrev.get(team, team) for team in subset]
+    vmax = np.percentile(np.abs(e[..., 1][v]), 95) if v.any() else 1.
+
+    frames = []
+    for ibucket, bucket in enumerate(buckets):
+        s, t = np.nonzero(v[ibucket])
+        volume = e[ibucket, s, t, 0]
+        norm = volume[s != t].max() if (s != t).any() else 1.
+        frames.append(dict(
+            path=os.path.join(out, name, '{:0>2}.png'.format(bucket)),
+            title='{} {}'.format(name, bucket),
+            names=names, pos=pos, source=s, target=t,
+            width=norm_scale * np.minimum(volume / norm, 1.), sentiment=e[ibucket, s, t, 1], vmax=max(vmax, 1e-6),
+        ))
+    return frames
+
+
+def resolve_backend(backend='auto'):
+    """
+    'graph-tool' if requested or installed, otherwise 'matplotlib'.
+    """
+    if backend not in BACKENDS:
+        raise ValueError('Unknown graph backend {!r}, expected one of {}'.format(backend, BACKENDS))
+    if backend == 'auto':
+        return 'graph-tool' if importlib.util.find_spec('graph_tool') is not None else 'matplotlib'
+    return backend
+
+
+def _edge_colors(frame):
+    from matplotlib import colormaps
+    from matplotlib.colors import Normalize
+    return colormaps['RdYlGn'](Normalize(-frame['vmax'], frame['vmax'])(frame['sentiment']))
+
+
+def draw_graph_tool(frame, ink_scale=1.):
+    """
+    Draw a frame with graph-tool at the subset's fixed positions.
+    """
+    from utils import graph_backend
+    gt = graph_backend()
+
+    g = gt.Graph(directed=True)
+    g.add_vertex(len(frame['names']))
+    width = g.new_ep('double')
+    color = g.new_ep('vector<double>')
+    g.add_edge_list(np.column_stack([frame['source'], frame['target']]))
+    width.a = frame['width']
+    for edge, rgba in zip(g.edges(), _edge_colors(frame)):
+        color[edge] = list(rgba)
+
+    pos = g.new_vp('vector<double>')
+    names = g.new_vp('string')
+    for v in g.vertices():
+        pos[v] = list(frame['pos'][int(v)])
+        names[v] = frame['names'][int(v)]
+
+    gt.graph_draw(g, pos=pos, vertex_text=names, edge_color=color, edge_pen_width=width, ink_scale=ink_scale,
+                  output=frame['path'])
+
+
+def draw_matplotlib(frame, ink_scale=1.):
+    """
+    Draw a frame with matplotlib at the subset's fixed positions.
+
+    Edges are curved arrows so both directions of a pair stay visible. Self edges are shown
+    as the vertex color rather than as loops.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    pos, names = frame['pos'], frame['names']
+    colors = _edge_colors(frame)
+    fig, ax = plt.subplots(figsize=(6, 6))
+
+    vertex_color = ['lightgray'] * len(names)
+    for s, t, w, c in zip(frame['source'], frame['target'], frame['width'], colors):
+        if s == t:
+            vertex_color[s] = c
+            continue
+        ax.annotate('', xy=pos[t], xytext=pos[s],
+                    arrowprops=dict(arrowstyle='-|>', lw=2 * ink_scale * w, color=c, shrinkA=18, shrinkB=18,
+                                    connectionstyle='arc3,rad=0.15'))
+
+    ax.scatter(pos[:, 0], pos[:, 1], s=1200, c=vertex_color, edgecolors='black', zorder=3)
+    for (x, y), name in zip(pos, names):
+        ax.text(x, y, name, ha='center', va='center', fontsize=11, zorder=4)
+
+    ax.set_title(frame['title'])
+    ax.set_xlim(-1.3, 1.3)
+    ax.set_ylim(-1.3, 1.3)
+    ax.set_aspect('equal')
+    ax.axis('off')
+    fig.savefig(frame['path'], dpi=100)
+    plt.close(fig)
+
+
+def render_frame(frame, backend='matplotlib', ink_scale=1.):
+    if backend == 'graph-tool':
+        draw_graph_tool(frame, ink_scale)
+    else:
+        draw_matplotlib(frame, ink_scale)
+    return frame['path']
+
+
+def render_frames(source, subsets, buckets=None, out='plots/frames', n_workers=None, backend='auto', ink_scale=1.,
+                  norm_scale=3., relayout=False):
+    """
+    Render the rivalry graph of every team subset in every bucket.
+
+    Args:
+    - source (str): Saved cube path or output folder with all_edges.pkl files (see load_edges).
+    - subsets (dict): Team subreddits of each subset, keyed by name.
+    - buckets (list): Buckets to draw. Defaults to every bucket of the source.
+    - out (str): Frames are written to <out>/<subset>/<bucket>.png.
+    - n_workers (int): Number of drawing processes. Defaults to the number of CPUs.
+    - backend (str): 'graph-tool', 'matplotlib', or 'auto' to use graph-tool when it is installed.
+    - ink_scale (float): Scale factor for the ink used in rendering the graph.
+    - norm_scale (float): Edge width of the frame's largest volume.
+    - relayout (bool): Recompute layouts saved by an earlier run.
+
+    Returns:
+    - paths (list): Written frame images.
+    """
+    backend = resolve_backend(backend)
+    buckets, teams, edges, valid = load_edges(source, buckets)
+
+    frames = []
+    for name, subset in subsets.items():
+        frames += subset_frames(name, subset, buckets, teams, edges, valid, out, norm_scale, relayout)
+
+    draw = functools.partial(render_frame, backend=backend, ink_scale=ink_scale)
+    if n_workers == 1 or len(frames) == 1:
+        return [draw(frame) for frame in frames]
+    with Pool(n_workers) as pool:
+        return pool.map(draw, frames)
+
+
+def parse_subsets(specs):
+    """
+    Subsets from names in SUBSETS or name=team,team,... specs.
+    """
+    subsets = dict()
+    for spec in specs:
+        if '=' in spec:
+            name, members = spec.split('=', 1)
+            subsets[name] = members.split(',')
+        else:
+            subsets[spec] = SUBSETS[spec]
+    return subsets
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    paths = render_frames(args.source, parse_subsets(args.subsets), args.buckets, args.out, args.workers, args.backend,
+                          args.ink_scale, args.norm_scale, args.relayout)
+    print('Rendered', len(paths), 'frames to', args.out)
@@ -1,11 +1,18 @@
+import os
 import json
+import time
+import shutil
+import threading
 import requests
 import praw
 import prawcore
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pandas as pd
 import argparse
+from instrument import RunReport, start_stage
 
 # Setting up command-line argument parsing
 parser = argparse.ArgumentParser()
@@ -13,6 +20,79 @@ parser.add_argument('--subreddit', type=str, required=True)
 parser.add_argument('--Nposts', type=int, required=True)
 parser.add_argument('--Ncomments', type=int, required=True)
 parser.add_argument('--group', type=str, required=True)
+parser.add_argument('--workers', type=int, default=8)
+parser.add_argument('--rate', type=float, default=100/60., help='Reddit API requests per second')
+parser.add_argument('--chunk_rows', type=int, default=10000, help='Comments buffered before writing a chunk')
+parser.add_argument('--cache_dir', type=str, default='data/redditor_cache', help='Redditor history cache shared across subreddits')
+parser.add_argument('--max_age', type=float, default=7., help='Days before a cached history is topped up')
+parser.add_argument('--report', type=str, default=None, help='Run report JSONL file to append this scrape to')
+parser.add_argument('--run_id', type=str, default=None, help='Run id of the report records')
+
+# Columns returned for redditor comment histories, in output order
+COMMENT_COLUMNS = ['author', 'body', 'score', 'subreddit', 'link_id', 'over_18', 'controversiality', 'author_flair_text', 'created_utc']
+
+# Errors worth retrying: 5xx responses, rate limiting and dropped connections
+TRANSIENT_ERRORS = (prawcore.exceptions.ServerError,
+                    prawcore.exceptions.TooManyRequests,
+                    prawcore.exceptions.RequestException)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all fetch workers.
+
+    Parameters:
+    - rate (float): Tokens added per second.
+    - capacity (float): Maximum burst size. Defaults to one second's worth of tokens, at least 1.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = max(1., rate) if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """
+        Block until n tokens are available and take them.
+
+        Raises ValueError if n exceeds the capacity, since the bucket would never hold n tokens.
+        """
+        if n > self.capacity:
+            raise ValueError('Cannot acquire {} tokens from a bucket of capacity {}'.format(n, self.capacity))
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# One praw client per thread, since praw.Reddit is not thread-safe
+_clients = threading.local()
+_credentials = None
+
+
+def get_reddit():
+    """
+    Return the Reddit client for the current thread, creating it on first use.
+
+    credentials.json is read once per process.
+    """
+    global _credentials
+    if _credentials is None:
+        with open('credentials.json', 'r') as f:
+            _credentials = json.load(f)
+
+    if not hasattr(_clients, 'reddit'):
+        _clients.reddit = praw.Reddit(**_credentials)
+    return _clients.reddit
+
 
 def scrape_post_comments(name, N=10, sort='hot'):
     """
@@ -26,10 +106,7 @@ def scrape_post_comments(name, N=10, sort='hot'):
     Returns:
     - df (DataFrame):  DataFrame containing the scraped posts or comments and metadata.
     """
-    with open('credentials.json', 'r') as f:
-        creds = json.load(f)
-
-        reddit = praw.Reddit(**creds)
+    reddit = get_reddit()
         
     columns = ['author', 'body', 'created_utc', 'score', 'subreddit', 'link_id', 'author_flair_text']
     pdict = dict(zip(columns, [[] for i in range(len(columns))]))
@@ -69,7 +146,7 @@ def scrape_post_comments(name, N=10, sort='hot'):
     df = pd.DataFrame(pdict)
     return df
             
-def scrape_posts_or_comments(name, kind='subreddit', N=10, sort='new'):
+def scrape_posts_or_comments(name, kind='subreddit', N=10, sort='new', reddit=None, after=None):
     """
     Scrapes either posts from a subreddit or comments from a user.
 
@@ -78,14 +155,14 @@ def scrape_posts_or_comments(name, kind='subreddit', N=10, sort='new'):
     - kind (str): The kind of object to scrape ('subreddit' or 'redditor').
     - N (int): The number of posts/comments to scrape 
     - sort (str): The sorting method for the data. 
+    - reddit (praw.Reddit): Client to use. Defaults to the shared client of the current thread.
+    - after (float): With sort='new', stop at the first item created at or before this epoch time.
 
     Returns:
     - df (DataFrame): DataFrame containing the scraped posts or comments and metadata.
     """
-    with open('credentials.json', 'r') as f:
-        creds = json.load(f)
-
-        reddit = praw.Reddit(**creds)
+    if reddit is None:
+        reddit = get_reddit()
     
     if kind == 'subreddit':
         hub = reddit.subreddit(name)
@@ -128,6 +205,10 @@ def scrape_posts_or_comments(name, kind='subreddit', N=10, sort='new'):
         except prawcore.exceptions.NotFound:
             print('Comment Not Found. Continuing')
             break
+
+        # Everything from here on is already known
+        if after is not None and post.created_utc <= after:
+            break
             
         for key in columns:
             pdict[key].append(getattr(post, key))
@@ -145,22 +226,276 @@ def scrape_posts_or_comments(name, kind='subreddit', N=10, sort='new'):
     df = pd.DataFrame(pdict)
     return df
 
+class HistoryCache:
+    """
+    Local cache of redditor comment histories shared by all subreddit scrapes.
+
+    Each history is a CSV named after the user, so separate scrape processes can share
+    the cache. A history is fresh for max_age seconds after it was last written.
+
+    Parameters:
+    - root (str): Cache folder.
+    - max_age (float): Freshness window in seconds.
+    """
+
+    def __init__(self, root='data/redditor_cache', max_age=7 * 86400):
+        self.root = root
+        self.max_age = max_age
+        self.hits = 0
+        self.topups = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, author):
+        return os.path.join(self.root, '{}.csv'.format(author))
+
+    def is_fresh(self, author):
+        path = self.path(author)
+        return os.path.exists(path) and time.time() - os.path.getmtime(path) < self.max_age
+
+    def get(self, author):
+        """
+        Return the cached history of author, or None, and whether it is still fresh.
+        """
+        path = self.path(author)
+        if not os.path.exists(path):
+            return None, False
+        return pd.read_csv(path, lineterminator='\n'), self.is_fresh(author)
+
+    def put(self, author, df):
+        # Write then rename, so readers never see a partial file
+        tmp = self.path(author) + '.tmp{}'.format(threading.get_ident())
+        df.to_csv(tmp, index=False)
+        os.replace(tmp, self.path(author))
+
+    def count(self, kind):
+        with self.lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+
+
+def fetch_redditor_history(author, N, cache, reddit=None):
+    """
+    Fetch an author's N most recent comments through the history cache.
+
+    Fresh cached histories are returned without any API calls. Stale ones are topped up
+    with only the comments newer than the newest cached comment.
+
+    Parameters:
+    - author (str): The author to fetch.
+    - N (int): The number of most recent comments to return.
+    - cache (HistoryCache): The history cache.
+    - reddit (praw.Reddit): Client to use. Defaults to the shared client of the current thread.
+
+    Returns:
+    - df (DataFrame): The author's comments, newest first.
+    """
+    cached, fresh = cache.get(author)
+    if cached is not None and fresh:
+        cache.count('hits')
+        return cached.head(N)
+
+    after = None
+    if cached is not None and len(cached) > 0:
+        after = max(datetime.strptime(t, '%Y-%m-%dT%H:%M:%SZ').timestamp() for t in cached.created_utc)
+        cache.count('topups')
+    else:
+        cache.count('misses')
+
+    new = scrape_posts_or_comments(author, kind='redditor', N=N, reddit=reddit, after=after)
+    if cached is not None and len(cached) > 0:
+        new = pd.concat([new, cached], ignore_index=True).head(N)
+
+    cache.put(author, new)
+    return new
+
+
+def fetch_with_retry(fetch, author, limiter, cost=1, retries=3, backoff=2.0, free=None):
+    """
+    Fetch one author's history, retrying transient API errors with exponential backoff.
+
+    Parameters:
+    - fetch (callable): Maps an author name to a DataFrame of their comments.
+    - author (str): The author to fetch.
+    - limiter (TokenBucket): Shared rate limiter, charged before every attempt.
+    - cost (int): Number of API requests one attempt uses.
+    - retries (int): Number of retries after the first attempt.
+    - backoff (float): Wait in seconds before the first retry, doubled for each further retry.
+    - free (callable): Returns True for authors served without API calls, which skip the limiter.
+
+    Returns:
+    - df (DataFrame): The author's comments, None if every attempt failed.
+    """
+    for attempt in range(retries + 1):
+        if free is None or not free(author):
+            limiter.acquire(cost)
+        try:
+            return fetch(author)
+        except TRANSIENT_ERRORS as e:
+            if attempt == retries:
+                print('Giving up on', author, repr(e))
+                return None
+            print('Retrying', author, repr(e))
+            time.sleep(backoff * 2 ** attempt)
+
+
+def fetch_author_histories(authors, N=10, n_workers=8, rate=100/60., retries=3, backoff=2.0, fetch=None, free=None):
+    """
+    Fetch the comment histories of many authors concurrently under a shared rate limit.
+
+    Forbidden and NotFound authors are handled by scrape_posts_or_comments and come back empty.
+    Authors that still fail after all retries come back as None. Only a bounded number of
+    fetches is in flight at once, so memory does not grow with the number of authors.
+
+    Parameters:
+    - authors (list): Author names.
+    - N (int): The number of comments to scrape per author.
+    - n_workers (int): Number of concurrent fetches.
+    - rate (float): API requests per second shared by all workers.
+    - retries (int): Retries per author on transient errors.
+    - backoff (float): Initial retry wait in seconds.
+    - fetch (callable): Maps an author name to a DataFrame. Defaults to scrape_posts_or_comments.
+    - free (callable): Returns True for authors served without API calls, e.g. HistoryCache.is_fresh.
+
+    Returns:
+    - histories (generator): (author, DataFrame) pairs in the order of authors.
+    """
+    if fetch is None:
+        fetch = lambda author: scrape_posts_or_comments(author, kind='redditor', N=N)
+
+    # Listings are paged 100 comments per request. The bucket must hold a whole attempt
+    cost = max(1, int(np.ceil(N / 100)))
+    limiter = TokenBucket(rate, capacity=max(1., rate, cost))
+
+    with ThreadPoolExecutor(n_workers) as pool:
+        pending = deque()
+        for author in authors:
+            pending.append((author, pool.submit(fetch_with_retry, fetch, author, limiter, cost, retries, backoff, free)))
+            if len(pending) >= 4 * n_workers:
+                author, future = pending.popleft()
+                yield author, future.result()
+
+        while pending:
+            author, future = pending.popleft()
+            yield author, future.result()
+
+
+class ChunkedWriter:
+    """
+    Streams scraped comments to chunk files next to the output CSV and merges them at the end.
+
+    Chunks live in <outfile>.parts/ alongside a manifest recording, for every chunk, its
+    row count and the authors it completes. A restarted run reads the manifest and skips
+    those authors.
+
+    Parameters:
+    - outfile (str): Final CSV path.
+    - chunk_rows (int): Number of comments buffered in memory before a chunk is written.
+    """
+
+    def __init__(self, outfile, chunk_rows=10000):
+        self.outfile = outfile
+        self.chunk_rows = chunk_rows
+        self.partdir = outfile + '.parts'
+        self.manifest = os.path.join(self.partdir, 'manifest.jsonl')
+        os.makedirs(self.partdir, exist_ok=True)
+
+        self.chunks = []
+        if os.path.exists(self.manifest):
+            with open(self.manifest, 'r') as f:
+                self.chunks = [json.loads(line) for line in f if line.strip()]
+
+        self.done = set(author for chunk in self.chunks for author in chunk['authors'])
+        self.n_rows = sum(chunk['rows'] for chunk in self.chunks)
+        self.buffer = []
+        self.authors = []
+
+    def write(self, author, df):
+        """
+        Buffer one author's comments, writing a chunk once enough rows have accumulated.
+        """
+        self.buffer.append(df.reindex(columns=COMMENT_COLUMNS))
+        self.authors.append(author)
+        if sum(len(d) for d in self.buffer) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered comments as a chunk and record its authors as completed.
+        """
+        if not self.authors:
+            return
+
+        df = pd.concat(self.buffer, ignore_index=True)
+        df.index += self.n_rows  # keep the row numbering of a single CSV
+        name = 'part-{:05d}.csv'.format(len(self.chunks))
+        df.to_csv(os.path.join(self.partdir, name), header=False)
+
+        # The manifest is only updated once the chunk is on disk
+        chunk = dict(name=name, rows=len(df), authors=[str(a) for a in self.authors])
+        with open(self.manifest, 'a') as f:
+            f.write(json.dumps(chunk) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.chunks.append(chunk)
+        self.done.update(chunk['authors'])
+        self.n_rows += len(df)
+        self.buffer = []
+        self.authors = []
+
+    def merge(self):
+        """
+        Concatenate all chunks into the output CSV and remove the chunk folder.
+        """
+        self.flush()
+        with open(self.outfile, 'w') as out:
+            pd.DataFrame(columns=COMMENT_COLUMNS).to_csv(out)
+            for chunk in self.chunks:
+                with open(os.path.join(self.partdir, chunk['name']), 'r') as f:
+                    shutil.copyfileobj(f, out)
+        shutil.rmtree(self.partdir)
+
+
 if __name__ == "__main__":
     args = parser.parse_args()
+    report = RunReport(args.report, args.run_id) if args.report else None
+    record = start_stage(report, 'scrape', team=args.subreddit)
     
-    # Scrape posts from the specified subreddit
-    posts = scrape_posts_or_comments(args.subreddit, kind='subreddit', N=args.Nposts)
-    posts.to_csv('data/' + args.group + '/posts/' + args.subreddit + '.csv')
+    postfile = 'data/' + args.group + '/posts/' + args.subreddit + '.csv'
+    outfile = 'data/' + args.group + '/comments/' + args.subreddit + '.csv'
+    resuming = os.path.exists(outfile + '.parts')
+
+    # Scrape posts from the specified subreddit, reusing them when resuming an interrupted run
+    if resuming and os.path.exists(postfile):
+        posts = pd.read_csv(postfile)
+    else:
+        posts = scrape_posts_or_comments(args.subreddit, kind='subreddit', N=args.Nposts)
+        posts.to_csv(postfile)
     
     # Get unique authors from the scraped posts
-    authors = np.unique(posts.author)
+    authors = np.unique(posts.author.astype(str))
     
-    comments = pd.DataFrame()
+    writer = ChunkedWriter(outfile, chunk_rows=args.chunk_rows)
+    todo = [author for author in authors if author not in writer.done]
+    print('Skipping', len(authors) - len(todo), 'authors scraped in a previous run')
+    record.set(rows_in=len(todo), resumed_authors=len(authors) - len(todo))
     
-    # Scrape comments for each author
-    for ii, author in enumerate(authors):
+    # Scrape comments for each author through the shared history cache, streaming them to disk
+    cache = HistoryCache(args.cache_dir, max_age=args.max_age * 86400)
+    fetch = lambda author: fetch_redditor_history(author, args.Ncomments, cache)
+    histories = fetch_author_histories(todo, N=args.Ncomments, n_workers=args.workers, rate=args.rate,
+                                       fetch=fetch, free=cache.is_fresh)
+    n_comments = 0
+    for ii, (author, new_comments) in enumerate(histories):
         print(ii, author)
-        new_comments = scrape_posts_or_comments(author, kind='redditor', N=args.Ncomments)
-        comments = comments.append(new_comments, ignore_index=True)
+        if new_comments is None:
+            record.drop('failed_authors', 1)
+            continue
+        writer.write(author, new_comments)
+        n_comments += len(new_comments)
         
-    comments.to_csv('data/' + args.group + '/comments/' + args.subreddit + '.csv')
+    writer.merge()
+    print('History cache: {} fresh, {} topped up, {} fetched'.format(cache.hits, cache.topups, cache.misses))
+    record.hit_rate('cache_hits', cache.hits, cache.topups + cache.misses)
+    record.finish(rows_out=n_comments, cache_topups=cache.topups)
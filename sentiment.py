@@ -0,0 +1,206 @@
+import os
+import hashlib
+import functools
+import sqlite3
+import numpy as np
+from importlib import metadata
+from multiprocessing import Pool
+
+# Scoring backends: the reference VADER analyzer, or the batched NumPy port in vader_batch.py
+BACKENDS = ('vader', 'numpy')
+
+# One analyzer per process, created by _init_worker. VADER and NLTK are only imported
+# there, so importing this module stays cheap for processes that never score.
+analyzer = None
+batch_analyzer = None
+sent_tokenize = None
+
+
+def _init_worker(backend='vader'):
+    """
+    Create the VADER analyzer for the current process.
+    """
+    global analyzer, batch_analyzer, sent_tokenize
+    if backend not in BACKENDS:
+        raise ValueError('Unknown sentiment backend {!r}, expected one of {}'.format(backend, BACKENDS))
+    if analyzer is None:
+        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+        from nltk import tokenize
+        analyzer = SentimentIntensityAnalyzer()
+        sent_tokenize = tokenize.sent_tokenize
+    if backend == 'numpy' and batch_analyzer is None:
+        from vader_batch import BatchVader
+        batch_analyzer = BatchVader(analyzer)
+
+
+def comment_sentiment(body):
+    """
+    Average VADER compound score over the sentences of a comment.
+
+    Args:
+    - body (str): Comment text.
+
+    Returns:
+    - sentiment (float): Mean compound score of the comment's sentences, 0 for a comment without sentences.
+    """
+    sentence_list = sent_tokenize(body)  # Tokenize comment into sentences
+    commentSentiment = 0.0
+    if len(sentence_list) == 0:
+        return commentSentiment
+
+    # Calculate sentiment for each sentence and aggregate
+    for sentence in sentence_list:
+        vs = analyzer.polarity_scores(sentence)
+        commentSentiment += vs["compound"]
+
+    return commentSentiment / len(sentence_list)
+
+
+def analyzer_version(backend='vader'):
+    """
+    Version string identifying the scoring code, used to key cached scores.
+    """
+    try:
+        version = 'vader-' + metadata.version('vaderSentiment')
+    except metadata.PackageNotFoundError:
+        version = 'vader-unknown'
+    return version if backend == 'vader' else version + '-' + backend
+
+
+class SentimentCache:
+    """
+    On-disk cache of comment sentiment keyed by a hash of the body and analyzer version.
+
+    Scores of every backend share one table under different keys. score_comments keys entries
+    with the version of the backend it scores with; version and backend only set the default.
+    Entries are evicted least-recently-used first once the cache holds more than
+    max_entries scores. Lookups are counted in hits and misses.
+    """
+
+    def __init__(self, path='data/sentiment_cache.sqlite', max_entries=2000000, version=None, backend='vader'):
+        self.path = path
+        self.max_entries = max_entries
+        self.version = analyzer_version(backend) if version is None else version
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS sentiment (key TEXT PRIMARY KEY, score REAL, used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS sentiment_used ON sentiment (used)')
+
+        # Logical clock for LRU ordering, carried across runs
+        self.clock = self.db.execute('SELECT COALESCE(MAX(used), 0) FROM sentiment').fetchone()[0]
+
+    def key(self, body, version=None):
+        version = self.version if version is None else version
+        return hashlib.sha1((version + '\0' + body).encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """
+        Look up cached scores and mark them as recently used.
+
+        Args:
+        - keys (list): Cache keys from SentimentCache.key.
+
+        Returns:
+        - found (dict): Cached score for every key present in the cache.
+        """
+        found = dict()
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self.db.execute(
+                'SELECT key, score FROM sentiment WHERE key IN ({})'.format(','.join('?' * len(batch))), batch)
+            found.update(rows.fetchall())
+
+        self.clock += 1
+        self.db.executemany('UPDATE sentiment SET used = ? WHERE key = ?', [(self.clock, k) for k in found])
+        self.db.commit()
+        return found
+
+    def put_many(self, scores):
+        """
+        Store scores and evict the least recently used entries over max_entries.
+
+        Args:
+        - scores (dict): Score for each cache key.
+        """
+        self.clock += 1
+        self.db.executemany('INSERT OR REPLACE INTO sentiment VALUES (?, ?, ?)',
+                            [(k, float(v), self.clock) for k, v in scores.items()])
+
+        n_entries = self.db.execute('SELECT COUNT(*) FROM sentiment').fetchone()[0]
+        if n_entries > self.max_entries:
+            self.db.execute('DELETE FROM sentiment WHERE key IN '
+                            '(SELECT key FROM sentiment ORDER BY used LIMIT ?)', (n_entries - self.max_entries,))
+        self.db.commit()
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n else 0.0
+
+    def close(self):
+        self.db.close()
+
+
+def _score_chunk(bodies, backend='vader'):
+    if backend == 'numpy':
+        return list(batch_analyzer.score_comments(bodies))
+    return [comment_sentiment(body) for body in bodies]
+
+
+def score_comments(bodies, n_workers=None, chunk_size=5000, cache=None, backend='vader'):
+    """
+    Score comment bodies with VADER, sharding the work across a process pool.
+
+    Args:
+    - bodies (array-like): Comment texts.
+    - n_workers (int): Number of worker processes. Defaults to the number of CPUs.
+    - chunk_size (int): Number of comments handed to a worker at a time.
+    - cache (SentimentCache): Optional cache consulted before scoring. Repeated bodies are scored once.
+    - backend (str): 'vader' scores sentence by sentence with the reference analyzer, 'numpy' scores
+                     each chunk at once with vader_batch.BatchVader.
+
+    Returns:
+    - sentiments (np.ndarray): Comment sentiment scores, in the same order as bodies.
+    """
+    bodies = list(bodies)
+    if cache is not None:
+        return _score_cached(bodies, n_workers, chunk_size, cache, backend)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    # Not worth spinning up a pool for a single chunk
+    if n_workers == 1 or len(bodies) <= chunk_size:
+        _init_worker(backend)
+        return np.array(_score_chunk(bodies, backend), dtype=float)
+
+    chunks = [bodies[i:i + chunk_size] for i in range(0, len(bodies), chunk_size)]
+
+    # Pool.map returns the chunks in submission order
+    with Pool(n_workers, initializer=_init_worker, initargs=(backend,)) as pool:
+        results = pool.map(functools.partial(_score_chunk, backend=backend), chunks)
+
+    return np.array([s for chunk in results for s in chunk], dtype=float)
+
+
+def _score_cached(bodies, n_workers, chunk_size, cache, backend):
+    # Keyed by the backend actually scoring, whatever backend the cache was opened with
+    version = analyzer_version(backend)
+    keys = [cache.key(body, version) for body in bodies]
+    known = cache.get_many(list(set(keys)))
+
+    # Score each distinct uncached body once
+    todo = dict()
+    for key, body in zip(keys, bodies):
+        if key not in known and key not in todo:
+            todo[key] = body
+    scored = dict(zip(todo, score_comments(list(todo.values()), n_workers, chunk_size, backend=backend)))
+    cache.put_many(scored)
+
+    # Every comment not sent to the analyzer counts as a hit
+    cache.misses += len(todo)
+    cache.hits += len(bodies) - len(todo)
+
+    known.update(scored)
+    return np.array([known[key] for key in keys], dtype=float)
@@ -0,0 +1,287 @@
+"""
+Local HTTP/JSON query service over the interaction cube.
+
+Per-week team summaries and edges are computed once from the cube when the service starts
+and kept in memory. Answers are cached per query in an LRU cache. When the pipeline writes
+a new cube or new confidence intervals, the arrays are rebuilt in the background and
+swapped in, and the cache starts over.
+
+    python serve.py data/nfl_nonzero --port 8765
+
+    GET /metric?team=eagles&metric=sent&direction=self&start=1&stop=24
+    GET /rivals?team=eagles&phase=regular&k=5&metric=weight&direction=out
+    GET /stats
+
+metric is one of weight, sent, cont and score; direction is in, out or self (self only for sent).
+Rivals are ranked by the edge metric from the team (out) or into it (in).
+
+    from serve import QueryClient
+    client = QueryClient('http://127.0.0.1:8765')
+    client.metric('buffalobills', 'sent', 'in', 1, 24)
+"""
+import os
+import json
+import time
+import argparse
+import functools
+import threading
+import http.client
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from cube import InteractionCube, SUMMARY_COLUMNS
+from bootstrap import BootstrapIntervals
+
+parser = argparse.ArgumentParser()
+parser.add_argument('outdir', type=str, help='Pipeline output folder holding cube.npy, cube.json and optionally bootstrap.npz')
+parser.add_argument('--host', type=str, default='127.0.0.1')
+parser.add_argument('--port', type=int, default=8765)
+parser.add_argument('--cache_size', type=int, default=4096, help='Query results kept in the LRU cache')
+parser.add_argument('--poll', type=float, default=2., help='Seconds between checks for new pipeline outputs')
+
+METRICS = ('weight', 'sent', 'cont', 'score')
+DIRECTIONS = ('in', 'out', 'self')
+
+
+class QueryEngine:
+    """
+    Preloaded summary and edge arrays of one version of the pipeline outputs.
+
+    Parameters:
+    - outdir (str): Pipeline output folder, e.g. 'data/nfl_nonzero'.
+    - cache_size (int): Query results kept in each LRU cache.
+    """
+
+    def __init__(self, outdir, cache_size=4096):
+        self.version = output_version(outdir)
+        cube = InteractionCube.load(os.path.join(outdir, 'cube'), mmap_mode=None)
+        self.buckets = cube.buckets
+        self.bucket2id = cube.bucket2id
+        self.teams = cube.teams
+        self.team2id = cube.team2id
+
+        # (bucket, team, column) summaries and (bucket, source, target, metric) edges
+        self.summary = cube.summary(combine=False)
+        edges, valid = cube.edges()
+        self.edges = np.where(valid[..., None], edges, np.nan)
+
+        cifile = os.path.join(outdir, 'bootstrap.npz')
+        self.ci = BootstrapIntervals.load(cifile) if os.path.exists(cifile) else None
+        if self.ci is not None and (self.ci.teams != self.teams or not set(self.buckets) <= set(self.ci.buckets)):
+            self.ci = None  # intervals of an older cube
+
+        self.metric = functools.lru_cache(maxsize=cache_size)(self._metric)
+        self.rivals = functools.lru_cache(maxsize=cache_size)(self._rivals)
+
+    def _team(self, team):
+        if team not in self.team2id:
+            raise ValueError('Unknown team {!r}'.format(team))
+        return self.team2id[team]
+
+    def _bucket(self, bucket):
+        if str(bucket) not in self.bucket2id:
+            raise ValueError('Unknown week or phase {!r}'.format(bucket))
+        return self.bucket2id[str(bucket)]
+
+    def _metric(self, team, metric='sent', direction='self', start=0, stop=24):
+        """
+        A team's summary metric in each week from start to stop, inclusive.
+        """
+        if metric not in METRICS or direction not in DIRECTIONS:
+            raise ValueError('metric must be one of {} and direction one of {}'.format(METRICS, DIRECTIONS))
+        if direction == 'self' and metric != 'sent':
+            raise ValueError('Only sentiment has a self direction')
+        column = SUMMARY_COLUMNS.index('self_sent' if direction == 'self' else '{}_{}'.format(direction, metric))
+
+        iteam = self._team(team)
+        weeks = list(range(int(start), int(stop) + 1))
+        ibuckets = [self._bucket(week) for week in weeks]
+        result = dict(team=team, metric=SUMMARY_COLUMNS[column], weeks=weeks,
+                      values=_floats(self.summary[ibuckets, iteam, column]))
+        if self.ci is not None:
+            bounds = self.ci.summary_ci[[self.ci.bucket2id[str(week)] for week in weeks], :, iteam, column]
+            result['lo'], result['hi'] = _floats(bounds[:, 0]), _floats(bounds[:, 1])
+        return result
+
+    def _rivals(self, team, phase='regular', k=5, metric='weight', direction='out'):
+        """
+        The k teams with the largest edge metric from (out) or into (in) a team in a week or phase.
+        """
+        if metric not in METRICS or direction not in ('in', 'out'):
+            raise ValueError('metric must be one of {} and direction in or out'.format(METRICS))
+        m = METRICS.index(metric)
+        iteam, ibucket = self._team(team), self._bucket(phase)
+
+        values = self.edges[ibucket, iteam, :, m] if direction == 'out' else self.edges[ibucket, :, iteam, m]
+        values = values.copy()
+        values[iteam] = np.nan  # a team is not its own rival
+        order = [i for i in np.argsort(-np.nan_to_num(values, nan=-np.inf), kind='stable') if not np.isnan(values[i])]
+
+        rivals = []
+        for i in order[:int(k)]:
+            rival = dict(team=self.teams[i], value=float(values[i]))
+            if self.ci is not None:
+                source, target = (iteam, i) if direction == 'out' else (i, iteam)
+                lo, hi = self.ci.edge_ci[self.ci.bucket2id[str(phase)], :, source, target, m]
+                rival['lo'], rival['hi'] = _floats([lo, hi])
+            rivals.append(rival)
+        return dict(team=team, phase=str(phase), metric=metric, direction=direction, rivals=rivals)
+
+    def cache_info(self):
+        return dict(metric=self.metric.cache_info()._asdict(), rivals=self.rivals.cache_info()._asdict())
+
+
+def _floats(values):
+    # JSON has no NaN
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def output_version(outdir):
+    """
+    Size and modification time of each output the engine reads, to detect new pipeline runs.
+    """
+    version = []
+    for name in ['cube.npy', 'cube.json', 'bootstrap.npz']:
+        path = os.path.join(outdir, name)
+        if os.path.exists(path):
+            st = os.stat(path)
+            version.append([name, st.st_size, st.st_mtime_ns])
+    return version
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering queries from the current QueryEngine.
+
+    A background thread polls the outputs every poll seconds. Once they change and stay
+    unchanged for one more poll, so a half-written cube is not read, a new engine is built
+    and swapped in. Requests in flight finish on the engine they started with.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, outdir, host='127.0.0.1', port=8765, cache_size=4096, poll=2.):
+        self.outdir = outdir
+        self.cache_size = cache_size
+        self.poll = poll
+        self.engine = QueryEngine(outdir, cache_size)
+        self.reloads = 0
+        super().__init__((host, port), QueryHandler)
+
+        self.watcher = threading.Thread(target=self._watch, daemon=True)
+        self.watcher.start()
+
+    def _watch(self):
+        seen = self.engine.version
+        while True:
+            time.sleep(self.poll)
+            version = output_version(self.outdir)
+            if version == self.engine.version or version != seen:
+                seen = version
+                continue
+            try:
+                self.engine = QueryEngine(self.outdir, self.cache_size)
+                self.reloads += 1
+                print('Reloaded', self.outdir)
+            except Exception as e:
+                print('Reload failed, serving the previous outputs: {!r}'.format(e))
+            seen = self.engine.version
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive, so clients can reuse connections. Without TCP_NODELAY each answer waits
+    # ~40ms for a delayed ACK, since headers and body go out in separate writes
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        engine = self.server.engine
+
+        try:
+            if url.path == '/metric':
+                body = engine.metric(query.pop('team'), **_ints(query, ['start', 'stop']))
+            elif url.path == '/rivals':
+                body = engine.rivals(query.pop('team'), **_ints(query, ['k']))
+            elif url.path == '/stats':
+                body = dict(version=engine.version, reloads=self.server.reloads, cache=engine.cache_info(),
+                            teams=engine.teams, buckets=engine.buckets, intervals=engine.ci is not None)
+            else:
+                return self._send(404, dict(error='Unknown path {}'.format(url.path)))
+        except KeyError as e:
+            return self._send(400, dict(error='Missing parameter {}'.format(e)))
+        except (TypeError, ValueError) as e:
+            return self._send(400, dict(error=str(e)))
+        self._send(200, body)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _ints(query, names):
+    return {k: int(v) if k in names else v for k, v in query.items()}
+
+
+class QueryClient:
+    """
+    Python client for the query service. Each thread keeps its own persistent connection.
+
+    Parameters:
+    - url (str): Service address, e.g. 'http://127.0.0.1:8765'.
+    """
+
+    def __init__(self, url='http://127.0.0.1:8765', timeout=10.):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get(self, path, **params):
+        """
+        Raw JSON answer of a query. Raises ValueError with the service's message on bad queries.
+        """
+        target = path + '?' + urllib.parse.urlencode(params)
+        for attempt in range(2):
+            conn = getattr(self.local, 'conn', None)
+            if conn is None:
+                conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                conn.request('GET', target)
+                response = conn.getresponse()
+                body = json.loads(response.read())
+                break
+            except (ConnectionError, http.client.HTTPException):
+                # The server closed an idle connection; reconnect once
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise ValueError(body.get('error', response.status))
+        return body
+
+    def metric(self, team, metric='sent', direction='self', start=0, stop=24):
+        return self.get('/metric', team=team, metric=metric, direction=direction, start=start, stop=stop)
+
+    def rivals(self, team, phase='regular', k=5, metric='weight', direction='out'):
+        return self.get('/rivals', team=team, phase=phase, k=k, metric=metric, direction=direction)
+
+    def stats(self):
+        return self.get('/stats')
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    server = QueryServer(args.outdir, args.host, args.port, args.cache_size, args.poll)
+    print('Serving {} on http://{}:{}'.format(args.outdir, args.host, args.port))
+    server.serve_forever()
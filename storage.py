@@ -0,0 +1,91 @@
+import os
+import shutil
+import pandas as pd
+
+# pyarrow is imported inside the functions below, so importing utils does not load it
+
+# Column types used in the store, as pyarrow type aliases. Columns not listed here are stored as inferred by pyarrow.
+COLUMN_TYPES = dict(
+    author='string',
+    body='string',
+    created_utc='timestamp[s]',
+    score='double',
+    subreddit='string',
+    link_id='string',
+    over_18='bool',
+    controversiality='double',
+    author_flair_text='string',
+    flair='string',
+    sentiment='double',
+)
+
+
+def is_store(path):
+    """
+    Whether path is a team folder of the columnar store rather than a CSV file.
+    """
+    return os.path.isdir(path)
+
+
+def _to_table(coms):
+    import pyarrow as pa
+
+    coms = coms.drop(columns=[c for c in coms.columns if c.startswith('Unnamed')])
+    coms = coms.reset_index(drop=True)
+
+    if 'created_utc' in coms and not pd.api.types.is_datetime64_any_dtype(coms.created_utc):
+        coms = coms.assign(created_utc=pd.to_datetime(coms.created_utc, format='%Y-%m-%dT%H:%M:%SZ', errors='coerce'))
+
+    table = pa.Table.from_pandas(coms, preserve_index=False)
+    schema = pa.schema([pa.field(f.name, pa.type_for_alias(COLUMN_TYPES[f.name]) if f.name in COLUMN_TYPES else f.type)
+                        for f in table.schema])
+    return table.cast(schema)
+
+
+def write_comments(coms, path, weeks):
+    """
+    Write a team's comments to the store, partitioned by NFL week.
+
+    Any comments previously stored under path are replaced.
+
+    Args:
+    - coms (pd.DataFrame): Comments of a single team.
+    - path (str): Team folder in the store, e.g. 'data/nfl_nonzero/store/falcons'.
+    - weeks (array-like): NFL week of each comment, -1 for comments outside the season weeks.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = _to_table(coms).append_column('week', pa.array(weeks, type=pa.int32()))
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    pq.write_to_dataset(table, path, partition_cols=['week'])
+
+
+def read_comments(path, columns=None, weeks=None, filter=None):
+    """
+    Read a team's comments from the store.
+
+    Only the requested columns and the partitions and row groups that can match
+    the filters are read from disk.
+
+    Args:
+    - path (str): Team folder in the store.
+    - columns (list): Columns to load. Defaults to all columns, including 'week'.
+    - weeks (list): NFL weeks to load. Defaults to all weeks.
+    - filter (pyarrow.dataset.Expression): Additional row filter, e.g. ds.field('subreddit') == 'nfl'.
+
+    Returns:
+    - coms (pd.DataFrame): The selected comments.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format='parquet', partitioning=ds.partitioning(pa.schema([('week', pa.int32())]), flavor='hive'))
+
+    if weeks is not None:
+        week_filter = ds.field('week').isin(list(weeks))
+        filter = week_filter if filter is None else filter & week_filter
+
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
@@ -0,0 +1,134 @@
+"""
+Seeded synthetic comment corpora with the schema of the scraped data.
+
+    python synthetic.py data/synthetic/100000 --rows 100000 --seed 0
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from scrape import COMMENT_COLUMNS
+from registry import default_registry
+
+parser = argparse.ArgumentParser()
+parser.add_argument('outdir', type=str)
+parser.add_argument('--rows', type=int, default=100000)
+parser.add_argument('--team', type=str, default='eagles')
+parser.add_argument('--seed', type=int, default=0)
+
+# Comments fall in /r/nfl, the author's team subreddit, another team's subreddit or elsewhere
+SUBREDDIT_MIX = dict(nfl=0.4, own=0.3, other=0.25, elsewhere=0.05)
+
+NEUTRAL_WORDS = ('the a he they we it this that game team play qb line defense offense coach week season '
+                 'ref call drive snap field down yard pass run kick third to on in of for was is were').split()
+
+
+def generate_comments(rows, team='eagles', seed=0, n_authors=None, chunk=0):
+    """
+    Generate raw comments as scraped from a team subreddit's commenters.
+
+    Authors carry a ':Team: Team' flair, two thirds of them for the given team. Bodies are one
+    to three sentences mixing neutral words with VADER lexicon words, so sentiment scores
+    spread over [-1, 1] much like real comments. Times run from March 2021 to the 2023 playoffs.
+
+    Args:
+    - rows (int): Number of comments.
+    - team (str): Team subreddit the comments were scraped from.
+    - seed (int): Random seed. The same seed always gives the same corpus.
+    - n_authors (int): Number of distinct authors. Defaults to one per 50 comments.
+    - chunk (int): Chunk number, for corpora generated in pieces. Authors keep their team across chunks.
+
+    Returns:
+    - coms (pd.DataFrame): Comments with the columns of scrape.COMMENT_COLUMNS.
+    """
+    teams = default_registry().teams
+    subs = list(teams.subreddit)
+    flairs = list(teams.flair)
+    n_authors = n_authors or max(rows // 50, 1)
+
+    # Authors: name and team, two thirds for the scraped team
+    authors_rng = np.random.default_rng(seed)
+    author_team = np.where(authors_rng.random(n_authors) < 2 / 3, subs.index(team), authors_rng.integers(0, len(subs), n_authors))
+
+    rng = np.random.default_rng([seed, chunk])
+    author = rng.integers(0, n_authors, rows)
+    flair = np.array([':{0}: {0}'.format(f.title()) for f in flairs], dtype=object)[author_team[author]]
+
+    # Subreddit of each comment, relative to the author's team
+    kind = rng.choice(list(SUBREDDIT_MIX), size=rows, p=list(SUBREDDIT_MIX.values()))
+    subreddit = np.array(subs, dtype=object)[author_team[author]]
+    subreddit[kind == 'nfl'] = 'nfl'
+    other = kind == 'other'
+    subreddit[other] = np.array(subs, dtype=object)[rng.integers(0, len(subs), other.sum())]
+    subreddit[kind == 'elsewhere'] = 'AskReddit'
+
+    # Bodies: sentences of 4-15 words, about one in five from the VADER lexicon
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    lexicon = np.array(sorted(SentimentIntensityAnalyzer().lexicon), dtype=object)
+    neutral = np.array(NEUTRAL_WORDS, dtype=object)
+    n_sentences = rng.integers(1, 4, rows)
+    lengths = rng.integers(4, 16, n_sentences.sum())
+    n_words = lengths.sum()
+    words = np.where(rng.random(n_words) < 0.2, lexicon[rng.integers(0, len(lexicon), n_words)],
+                     neutral[rng.integers(0, len(neutral), n_words)])
+    ends = rng.choice(np.array(['.', '!', '?'], dtype=object), size=len(lengths), p=[0.8, 0.15, 0.05])
+    sentences = [' '.join(s).capitalize() + e for s, e in zip(np.split(words, np.cumsum(lengths)[:-1]), ends)]
+    bodies = [' '.join(b) for b in np.split(np.array(sentences, dtype=object), np.cumsum(n_sentences)[:-1])]
+
+    start = pd.Timestamp('2021-03-01').value // 10 ** 9
+    stop = pd.Timestamp('2023-02-14').value // 10 ** 9
+    created = pd.to_datetime(rng.integers(start, stop, rows), unit='s').strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    coms = pd.DataFrame(dict(
+        author=np.char.add('user', author.astype(str)).astype(object),
+        body=bodies,
+        score=rng.geometric(0.2, rows) - 2,
+        subreddit=subreddit,
+        link_id=np.char.add('t3_', rng.integers(0, rows // 20 + 1, rows).astype(str)).astype(object),
+        over_18=False,
+        controversiality=(rng.random(rows) < 0.05).astype(int),
+        author_flair_text=flair,
+        created_utc=created,
+    ))
+    return coms[COMMENT_COLUMNS]
+
+
+def write_corpus(outdir, rows, team='eagles', seed=0, chunk_rows=1000000):
+    """
+    Write a synthetic corpus for benchmarking each processing stage.
+
+    Outputs:
+    - <outdir>/raw/<team>.csv: rows raw comments, the input of process_coms.
+    - <outdir>/processed/<team>.csv: The same comments with 'flair' and 'sentiment' columns in the
+      layout process_coms writes, without running VADER. Input of the date filters and get_sub_edges.
+    - <outdir>/teams/<team>.csv: rows processed comments split evenly over all 32 teams, the input of
+      build_cube and the summary aggregation.
+
+    Chunks of chunk_rows comments are generated in turn, so memory does not grow with rows.
+    """
+    subs = list(default_registry().teams.subreddit)
+    for folder in ['raw', 'processed', 'teams']:
+        os.makedirs(os.path.join(outdir, folder), exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    offset = 0
+    for ichunk, n in enumerate(np.diff(np.append(np.arange(0, rows, chunk_rows), rows))):
+        coms = generate_comments(int(n), team, seed, n_authors=max(rows // 50, 1), chunk=ichunk)
+        coms.index = np.arange(offset, offset + n)
+        mode, header = ('w', True) if ichunk == 0 else ('a', False)
+        coms.to_csv(os.path.join(outdir, 'raw', team + '.csv'), mode=mode, header=header, index=False)
+
+        coms['flair'] = team
+        coms['sentiment'] = np.round(np.clip(rng.normal(0.1, 0.45, n), -1, 1), 4)
+        coms.to_csv(os.path.join(outdir, 'processed', team + '.csv'), mode=mode, header=header)
+
+        owner = (coms.index.values % len(subs))
+        for i, sub in enumerate(subs):
+            part = coms[owner == i].assign(flair=sub)
+            part.to_csv(os.path.join(outdir, 'teams', sub + '.csv'), mode=mode, header=header)
+        offset += n
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    write_corpus(args.outdir, args.rows, args.team, args.seed)
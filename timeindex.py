@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+from utils import read_coms
+from registry import default_registry
+
+# Subreddit categories used by the window metadata
+RNFL, SELF, OTHER, NONE = 0, 1, 2, 3
+
+DAY = 86400
+
+
+class TimeIndex:
+    """
+    A team's processed comments sorted by creation time, for fast arbitrary-window queries.
+
+    Times are int64 epoch seconds, so any [start, stop) window is a contiguous slice found by
+    binary search. Prefix sums of counts, sentiment and controversiality per subreddit category
+    give the metadata of many windows at once without touching the comments.
+    """
+
+    def __init__(self, team, t, category, sentiment, controversiality, rows):
+        self.team = team
+        self.t = t
+        self.category = category
+        self.sentiment = sentiment
+        self.controversiality = controversiality
+        self.rows = rows
+
+        # prefix[k, c, i]: sum over the first i comments in category c of
+        # count (k=0), sentiment (k=1) and controversiality (k=2)
+        onehot = np.zeros((4, len(t)))
+        onehot[category, np.arange(len(t))] = 1.
+        values = np.stack([onehot, onehot * sentiment, onehot * controversiality])
+        self.prefix = np.concatenate([np.zeros((3, 4, 1)), np.cumsum(values, axis=2)], axis=2)
+
+    @classmethod
+    def from_file(cls, filename):
+        """
+        Build the index from a processed comments CSV or store folder.
+        """
+        team = filename.rstrip('/').split('/')[-1].split('.')[0]
+        coms = read_coms(filename).dropna(subset=['author', 'body', 'author_flair_text'])
+
+        t = to_epoch(coms.created_utc)
+        good = t >= 0
+        coms, t = coms[good], t[good]
+
+        subreddit = coms.subreddit.str.lower()
+        category = np.full(len(coms), NONE)
+        category[subreddit.isin(default_registry().teams.subreddit.values).values] = OTHER
+        category[(subreddit == team).values] = SELF
+        category[(subreddit == 'nfl').values] = RNFL
+
+        order = np.argsort(t, kind='stable')
+        return cls(team, t[order], category[order], coms.sentiment.values[order],
+                   coms.controversiality.values[order], coms.index.values[order])
+
+    def save(self, path):
+        np.savez(path, team=self.team, t=self.t, category=self.category, sentiment=self.sentiment,
+                 controversiality=self.controversiality, rows=self.rows)
+
+    @classmethod
+    def load(cls, path):
+        d = np.load(path)
+        return cls(str(d['team']), d['t'], d['category'], d['sentiment'], d['controversiality'], d['rows'])
+
+    def locate(self, starts, stops):
+        """
+        Positions [lo, hi) of the comments in each [start, stop) window.
+
+        Args:
+        - starts, stops (array-like): Window edges as datetimes, date strings or epoch seconds.
+        """
+        return np.searchsorted(self.t, to_epoch(starts), 'left'), np.searchsorted(self.t, to_epoch(stops), 'left')
+
+    def window_rows(self, start, stop):
+        """
+        Row labels, in the processed file, of the comments within [start, stop), in time order.
+        """
+        lo, hi = self.locate([start], [stop])
+        return self.rows[lo[0]:hi[0]]
+
+    def window_metadata(self, starts, stops):
+        """
+        Metadata of filter_processed_coms_by_date for many [start, stop) windows in one pass.
+
+        filter_processed_coms_by_date(filename, start, stop) keeps comments whose date is strictly
+        between start and stop, which is the window [start + 1 day, stop) here when both are midnights.
+
+        Args:
+        - starts, stops (array-like): Window edges.
+
+        Returns:
+        - metadata (dict): The metadata layout of filter_processed_coms_by_date with one entry per
+                           window, plus 'start' and 'stop' columns.
+        """
+        lo, hi = self.locate(starts, stops)
+        sums = self.prefix[:, :, hi] - self.prefix[:, :, lo]  # (sum, category, window)
+
+        n_rnfl, n_self, n_other, n_none = sums[0]
+        n_nfl = n_rnfl + n_self + n_other
+        n_coms = n_nfl + n_none
+        denom = np.where(n_coms == 0, 1, n_coms)
+
+        def avg(count, sent, cont):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return [[s, c] for s, c in zip(sent / count, cont / count)]
+
+        metadata = dict(
+            team=[self.team] * len(lo),
+            start=list(pd.to_datetime(to_epoch(starts), unit='s')),
+            stop=list(pd.to_datetime(to_epoch(stops), unit='s')),
+            n_coms=list(denom.astype(int)),
+            perc_flaired_auth=list((n_coms > 0).astype(float)),
+            perc_rnfl_related=list(n_rnfl / denom),
+            perc_nfl_related=list(n_nfl / denom),
+            perc_self_related=list(n_self / denom),
+            perc_other_related=list(n_other / denom),
+            avg_rnfl_sent=avg(n_rnfl, sums[1, RNFL], sums[2, RNFL]),
+            avg_nfl_sent=avg(n_nfl, sums[1, :3].sum(axis=0), sums[2, :3].sum(axis=0)),
+            avg_self_sent=avg(n_self, sums[1, SELF], sums[2, SELF]),
+            avg_other_sent=avg(n_other, sums[1, OTHER], sums[2, OTHER]),
+        )
+        return metadata
+
+
+def to_epoch(values):
+    """
+    Convert datetimes, ISO strings or epoch seconds to int64 epoch seconds, -1 where missing.
+    """
+    if not isinstance(values, pd.Series):
+        values = pd.Series(np.asarray(values))
+    if pd.api.types.is_integer_dtype(values) or pd.api.types.is_float_dtype(values):
+        return values.fillna(-1).values.astype(np.int64)
+    dates = pd.to_datetime(values, format='ISO8601', errors='coerce', utc=True)
+    seconds = (dates - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+    return seconds.fillna(-1).values.astype(np.int64)
+
+
+def rolling_windows(start, stop, width=7 * DAY, step=DAY):
+    """
+    Start and stop epoch seconds of sliding windows of the given width, every step seconds.
+    """
+    starts = np.arange(to_epoch([start])[0], to_epoch([stop])[0] - width + 1, step)
+    return starts, starts + width
@@ -1,20 +1,31 @@
 import pandas as pd
 import numpy as np
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from nltk import tokenize
-import nltk
 import datetime
+import os
+from sentiment import score_comments
+from storage import is_store, read_comments, write_comments
+from registry import default_registry, encode_authors
+from instrument import start_stage
+
+# Team tables, read from the team lists on first access rather than at import
+_REGISTRY_ATTRS = dict(teams='teams', team2abbrev='team2abbrev', flair2team='flair2team')
+
+
+def __getattr__(name):
+    if name == 'registry':
+        return default_registry()
+    if name in _REGISTRY_ATTRS:
+        return getattr(default_registry(), _REGISTRY_ATTRS[name])
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def graph_backend():
+    """
+    The graph-tool drawing module, imported on first use.
+    """
+    import graph_tool.all as gt
+    return gt
 
-with open('nfl_subs.txt','r') as f:
-    subs = [s.strip() for s in f.readlines()]
-with open('nfl_flairs.txt','r') as f:
-    flairs = [fl.strip() for fl in f.readlines()]
-with open('nfl_inits.txt','r') as f:
-    inits = [i.strip() for i in f.readlines()]
-df = pd.DataFrame(dict(subreddit=subs, flair=flairs, inits=inits))
-teams=df
-team2abbrev = dict(zip(teams.subreddit,teams.inits))
-flair2team = dict(zip(teams.flair, teams.subreddit))
 
 def filter_comments_by_subs(filename, subs):
     
@@ -23,20 +34,160 @@ def filter_comments_by_subs(filename, subs):
     return coms[coms.subreddit.isin(subs.values)]
 
 
+def read_coms(filename, columns=None, weeks=None, filter=None):
+    """
+    Load comments from a CSV file or from a team folder of the columnar store.
+
+    Args:
+    - filename (str): Path to a comments CSV or a store folder such as 'data/nfl_nonzero/store/falcons'.
+    - columns (list): Columns to load. Defaults to all columns.
+    - weeks (list): NFL weeks to load from the store. Ignored for CSV files.
+    - filter (pyarrow.dataset.Expression): Row filter pushed down into the store. Ignored for CSV files.
+
+    Returns:
+    - coms (pd.DataFrame): Comments.
+    """
+    if is_store(filename):
+        return read_comments(filename, columns=columns, weeks=weeks, filter=filter)
+    return pd.read_csv(filename, lineterminator='\n', usecols=columns)
+
+
+def store_coms(coms, path, week_bounds=None):
+    """
+    Write a team's comments to the columnar store, partitioned by NFL week.
+
+    Args:
+    - coms (pd.DataFrame): Comments of a single team.
+    - path (str): Team folder in the store, e.g. 'data/nfl_nonzero/store/falcons'.
+    - week_bounds (list): Sorted week boundaries. Defaults to nfl_week_boundaries().
+    """
+    if week_bounds is None:
+        week_bounds = nfl_week_boundaries()
+    write_comments(coms, path, assign_buckets(parse_comment_dates(coms), week_bounds))
+
+
+def comment_keys(coms):
+    """
+    Stable 64-bit identity of each comment, hashed from its author, creation time and body.
+
+    Args:
+    - coms (pd.DataFrame): Comments with 'author', 'created_utc' and 'body' columns.
+
+    Returns:
+    - keys (np.ndarray): uint64 key per comment.
+    """
+    created = coms.created_utc
+    if pd.api.types.is_datetime64_any_dtype(created):
+        created = created.dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    ident = pd.DataFrame(dict(author=coms.author.astype(str), created_utc=created.astype(str), body=coms.body.astype(str)))
+    return pd.util.hash_pandas_object(ident, index=False).values
+
+
 def get_division_edges(sublist):
     edges = []
     for sub in sublist:
         edges.extend(get_sub_edges(sub, sublist))
     return edges
-        
 
-def process_coms(filename, no_zero_sentiment=False):
+
+def subset_masks(coms, subname):
+    """
+    Masks of a team's comments in /r/nfl, in any NFL subreddit, in its own subreddit and in other
+    team subreddits, computed from integer subreddit codes.
+
+    Args:
+    - coms (pd.DataFrame): Comments with a lowercase or registry-encoded 'subreddit' column.
+    - subname (str): Team subreddit.
+
+    Returns:
+    - masks (dict): Boolean arrays keyed by 'rnfl', 'nfl', 'self' and 'other'.
+    """
+    registry = default_registry()
+    subreddit = coms.subreddit
+    if not isinstance(subreddit.dtype, pd.CategoricalDtype) or subreddit.dtype != registry.subreddit_dtype:
+        subreddit = registry.encode_subreddits(subreddit)
+
+    codes = registry.codes(subreddit)
+    self_code = registry.code(subname)
+    return dict(
+        rnfl=codes == registry.NFL,
+        nfl=codes >= 0,
+        self=(codes == self_code) & (codes >= 0),
+        other=(codes > registry.NFL) & (codes != self_code),
+    )
+
+
+def resolve_author_flairs(coms):
+    """
+    Map authors to their team using the flair on their first /r/nfl comment.
+
+    Args:
+    - coms (pd.DataFrame): Comments with lowercase 'subreddit', 'author' and 'author_flair_text' columns.
+
+    Returns:
+    - author2team (pd.Series): Team subreddit indexed by author, for authors with a valid team flair.
+    """
+    # First /r/nfl comment per author, in file order
+    rnfl = coms[coms.subreddit == 'nfl'].drop_duplicates(subset='author', keep='first')
+
+    # Flairs look like ':Falcons: Falcons', the team name is the third field
+    flair = rnfl.author_flair_text.astype(str).str.split(':').str[2].str.lower().str.strip()
+
+    # Authors whose flair is not a team flair map to NaN and are dropped
+    author2team = pd.Series(flair.map(default_registry().flair2team).values, index=rnfl.author.values)
+
+    return author2team.dropna()
+
+
+def score_or_lookup(coms, scored=None, n_workers=None, chunk_size=5000, cache=None, backend='vader'):
+    """
+    Sentiment of each comment, taken from a shared scored store where available.
+
+    Args:
+    - coms (pd.DataFrame): Comments with 'author', 'created_utc' and 'body' columns.
+    - scored (ScoredComments): Optional store built by dedup.py. Comments missing from it are scored.
+    - n_workers, chunk_size, cache, backend: Passed to score_comments.
+
+    Returns:
+    - sentiments (np.ndarray): Comment sentiment scores.
+    """
+    if scored is None:
+        return score_comments(coms.body.values, n_workers=n_workers, chunk_size=chunk_size, cache=cache, backend=backend)
+
+    sentiments = scored.lookup(comment_keys(coms), backend=backend)
+    missing = np.isnan(sentiments)
+    if missing.any():
+        sentiments[missing] = score_comments(coms.body.values[missing], n_workers=n_workers, chunk_size=chunk_size,
+                                             cache=cache, backend=backend)
+    return sentiments
+
+
+def _lookup_counts(cache, scored):
+    # Hit and miss counters of the sentiment cache and the scored store before scoring
+    return [(c.hits, c.misses) if c is not None else (0, 0) for c in (cache, scored)]
+
+
+def _record_hit_rates(record, cache, scored, before):
+    for name, c, (hits, misses) in zip(['cache_hits', 'scored_hits'], (cache, scored), before):
+        if c is not None:
+            record.hit_rate(name, c.hits - hits, c.misses - misses)
+
+
+def process_coms(filename, no_zero_sentiment=False, n_workers=None, chunk_size=5000, cache=None, store=None, backend='vader',
+                 scored=None, report=None):
     """
     Process comments from a CSV file, perform sentiment analysis, and calculate various metrics.
 
     Args:
     - filename (str): Path to the CSV file containing comments.
     - no_zero_sentiment (bool): Flag to exclude comments with zero sentiment.
+    - n_workers (int): Number of processes used for sentiment scoring. Defaults to the number of CPUs.
+    - chunk_size (int): Number of comments scored per worker task.
+    - cache (SentimentCache): Optional on-disk sentiment cache shared across reruns.
+    - store (str): Optional root of the columnar store. Processed comments are also written to <store>/<subname>.
+    - backend (str): Sentiment scorer, 'vader' or the batched 'numpy' port (see sentiment.score_comments).
+    - scored (ScoredComments): Optional store of already scored comments built by dedup.py.
+    - report (RunReport): Optional run report to record timings, row counts and drops in.
 
     Returns:
     - coms (pd.DataFrame): Filtered comments DataFrame with sentiment scores.
@@ -45,22 +196,22 @@ def process_coms(filename, no_zero_sentiment=False):
 
     # Extract subreddit name from filename
     subname = filename.split('/')[-1].split('.')[0]
-
-    # List of all NFL team subreddits
-    all_nfl_subs = ['nfl'] + list(teams.subreddit.values)
-    all_other_team_subs = all_nfl_subs.copy()
-    
-    # Remove current subreddit and 'nfl' from the list of all other team subreddits
-    all_other_team_subs.remove(subname)
-    all_other_team_subs.remove('nfl')
+    registry = default_registry()
+    self_code = registry.code(subname)
+    record = start_stage(report, 'process_coms', team=subname, backend=backend)
 
     try:
-        coms = pd.read_csv(filename, lineterminator='\n').dropna(subset=['author', 'body', 'author_flair_text'])
+        coms = read_coms(filename)
+        n_read = len(coms)
+        coms = coms.dropna(subset=['author', 'body', 'author_flair_text'])
     except KeyError:
         return filename, None
+    record.set(rows_in=n_read)
+    record.drop('missing_fields', n_read - len(coms))
 
-    # Convert subreddit names to lowercase
-    coms.subreddit = coms.subreddit.str.lower()
+    # Encode lowercase subreddit names as registry codes and authors as a dictionary
+    coms.subreddit = registry.encode_subreddits(coms.subreddit.str.lower())
+    coms.author = encode_authors(coms.author)
 
     # Print total number of comments 
     print('Total comments:', len(coms))
@@ -68,105 +219,57 @@ def process_coms(filename, no_zero_sentiment=False):
     ##### Extract subreddit users who have commented on /r/nfl with flairs #####
 
     # Get unique authors who have commented
-    authors = np.unique(coms.author.values)
-    n_auth = len(authors)  
+    n_auth = coms.author.nunique()
     print('Unique authors:', n_auth)
 
-    flairs = []
-    flaired_authors = []
-
-    # Iterate over unique authors to find flaired users
-    for ii, author in enumerate(authors):
-        acoms = coms[coms.author.isin([author])]  # Comments by the current author
-        nfl_acoms = acoms[acoms.subreddit.isin(['nfl'])]  # Comments in /r/nfl by the current author
-        
-        # Skip if there are no comments by the author in /r/nfl
-        if len(nfl_acoms) == 0:
-            continue
-            
-        # Extract team flair and clean
-        nfl_acom = nfl_acoms.iloc[0]  
-        
-        raw_flair = nfl_acom.author_flair_text.split(':')  # Split author flair text by ':'
-        if len(raw_flair) < 3:
-            continue
-        
-        flair = raw_flair[2].lower().strip()  
-        
-        # Skip if the flair is not in the list of team flairs
-        if not flair in teams.flair.values:
-            continue
-        else:
-            flaired_authors.append(nfl_acom.author)  # Add the author to the list of flaired authors
-        
-        # Iterate over comments by the author
-        for jj, acom in acoms.iterrows():
-            flairs.append(flair2team[flair])  # Map the flair to a team using flair2team dictionary
+    # Map each flaired author to their team in a single grouped pass
+    author2team = resolve_author_flairs(coms)
 
     # Filter comments to include only those by flaired authors and add 'flair' column
-    coms = coms[coms.author.isin(flaired_authors)]
-    coms['flair'] = flairs
+    n_total = len(coms)
+    coms = coms[coms.author.isin(author2team.index)]
+    coms['flair'] = registry.encode_subreddits(coms.author.astype(object).map(author2team))
 
     n_all = len(coms)  # Total number of comments after filtering by flaired authors
+    record.drop('unflaired', n_total - n_all)
 
     # Filter comments to include only those in NFL-related subreddits and with the current subreddit flair
-    coms = coms[coms.subreddit.isin(all_nfl_subs)]
-    coms = coms.iloc[np.where(coms.flair == subname)[0]]  # Filter by current subreddit flair
+    in_nfl = registry.codes(coms.subreddit) >= 0
+    coms = coms[in_nfl & (registry.codes(coms.flair) == self_code)]
+    record.drop('outside_team', n_all - len(coms))
 
-    n_flaired_auth = len(np.unique(coms.author.values)) 
+    n_flaired_auth = coms.author.nunique()
     
     ###############################################
 
-    # Filter comments again to ensure they are in NFL-related subreddits
-
-    coms = coms[coms.subreddit.isin(all_nfl_subs)]
-
-    # Perform sentiment analysis on comments
-    sentiments = []
-    i_nonzero = []  # Indices of comments with non-zero sentiment
-
-    izero = 0
+    # Perform sentiment analysis on comments across a pool of workers
     print(len(coms), 0)
-    
-    # Iterate over comments to calculate sentiment
-    for ii, com in coms.iterrows():
-        sentence_list = tokenize.sent_tokenize(com.body)  # Tokenize comment into sentences
-        commentSentiment = 0.0
-        
-        # Calculate sentiment for each sentence and aggregate
-        for sentence in sentence_list:
-            vs = analyzer.polarity_scores(sentence)  # Perform sentiment analysis using analyzer
-            commentSentiment += vs["compound"]  # Add compound sentiment score
-        
-        commentSentiment /= len(sentence_list)  # Calculate average sentiment score for the comment
-
-        # Exclude comments with zero sentiment if no_zero_sentiment flag is set
-        if no_zero_sentiment:
-            if commentSentiment == 0.0:
-                izero += 1
-                continue
-            else:
-                sentiments.append(commentSentiment)
-                i_nonzero.append(ii)
-        else:
-            sentiments.append(commentSentiment)
-            i_nonzero.append(ii)
+    lookups = _lookup_counts(cache, scored)
+    sentiments = score_or_lookup(coms, scored, n_workers=n_workers, chunk_size=chunk_size, cache=cache, backend=backend)
+    _record_hit_rates(record, cache, scored, lookups)
 
-    # Add sentiment scores to comments DataFrame
+    # Exclude comments with zero sentiment if no_zero_sentiment flag is set
+    izero = 0
     if no_zero_sentiment:
-        coms = coms.loc[i_nonzero]
+        nonzero = sentiments != 0.0
+        izero = int((~nonzero).sum())
+        coms = coms[nonzero]
+        sentiments = sentiments[nonzero]
 
+    # Add sentiment scores to comments DataFrame
     coms['sentiment'] = sentiments
     print('Number of comments with zero sentiment:', izero)
+    record.drop('zero_sentiment', izero)
 
     n_coms = len(coms)  # Number of comments after sentiment analysis
     print('Number of remaining comments:', n_coms)
 
     # Partition comments
-    rnfl = coms[coms.subreddit.isin(['nfl'])]  # Comments in /r/nfl
-    nfl = coms[coms.subreddit.isin(all_nfl_subs)]  # Comments in all NFL-related subreddits
-    selfc = coms[coms.subreddit.isin([subname])]  # Comments in the current subreddit
-    other = coms[coms.subreddit.isin(all_other_team_subs)]  # Comments in other NFL team subreddits
+    masks = subset_masks(coms, subname)
+    rnfl = coms[masks['rnfl']]  # Comments in /r/nfl
+    nfl = coms[masks['nfl']]  # Comments in all NFL-related subreddits
+    selfc = coms[masks['self']]  # Comments in the current subreddit
+    other = coms[masks['other']]  # Comments in other NFL team subreddits
 
     # Calculate summary stats for each subset
     n_rnfl = len(rnfl)
@@ -201,61 +304,218 @@ def process_coms(filename, no_zero_sentiment=False):
         avg_other_sent=[avg_other_sent]
     )
 
+    if store is not None:
+        store_coms(coms, os.path.join(store, subname))
+
+    record.finish(rows_out=n_coms)
     return coms, metadata
 
-def filter_processed_coms_by_date(filename, start, stop):
+def process_coms_chunked(filename, outfile, no_zero_sentiment=False, chunk_rows=100000, n_workers=None, chunk_size=5000, cache=None,
+                         backend='vader', scored=None, report=None):
     """
-    Filters and processes comments from a CSV file within a specified date range and returns the filtered comments along with metadata.
+    Out-of-core version of process_coms for comment files larger than memory.
 
-    Parameters:
-    filename (str): The path to the CSV file containing comments data.
-    start (datetime): The start date for filtering comments.
-    stop (datetime): The end date for filtering comments.
+    The file is read twice in chunks of chunk_rows comments. The first pass resolves author
+    flairs from the first /r/nfl comment of each author. The second pass filters and scores
+    each chunk, appends it to outfile, and keeps running sums for the metadata. Peak memory
+    is set by chunk_rows, plus one entry per author.
+
+    Args:
+    - filename (str): Path to the CSV file containing comments.
+    - outfile (str): Path of the processed comments CSV to write.
+    - no_zero_sentiment (bool): Flag to exclude comments with zero sentiment.
+    - chunk_rows (int): Number of comments read at a time.
+    - n_workers (int): Number of processes used for sentiment scoring. Defaults to the number of CPUs.
+    - chunk_size (int): Number of comments scored per worker task.
+    - cache (SentimentCache): Optional on-disk sentiment cache shared across reruns.
+    - backend (str): Sentiment scorer, 'vader' or the batched 'numpy' port (see sentiment.score_comments).
+    - scored (ScoredComments): Optional store of already scored comments built by dedup.py.
+    - report (RunReport): Optional run report to record timings, row counts and drops in.
 
     Returns:
-    tuple: A tuple containing:
-        - coms (DataFrame): A pandas DataFrame with the filtered comments.
-        - metadata (dict): A dictionary containing metadata about the filtered comments.
+    - outfile (str): Path of the processed comments CSV, or filename if it could not be processed.
+    - metadata (dict): Same metrics as process_coms, up to floating point summation order.
     """
     subname = filename.split('/')[-1].split('.')[0]
-    
-    print(subname)
-    
-    # List of NFL-related subreddits
-    all_nfl_subs = ['nfl'] + list(teams.subreddit.values)
-    all_other_team_subs = all_nfl_subs.copy()
-    all_other_team_subs.remove(subname)
-    all_other_team_subs.remove('nfl')    
+    registry = default_registry()
+    self_code = registry.code(subname)
+    record = start_stage(report, 'process_coms_chunked', team=subname, backend=backend)
+    n_read = [0, 0]  # rows read, rows with missing fields
+
+    def read_chunks():
+        for chunk in pd.read_csv(filename, lineterminator='\n', chunksize=chunk_rows):
+            n = len(chunk)
+            chunk = chunk.dropna(subset=['author', 'body', 'author_flair_text'])
+            n_read[0] += n
+            n_read[1] += n - len(chunk)
+            chunk.subreddit = registry.encode_subreddits(chunk.subreddit.str.lower())
+            yield chunk
+
+    ##### First pass: unique authors and the first /r/nfl comment of each #####
+    authors = set()
+    firsts = []
+    try:
+        for chunk in read_chunks():
+            authors.update(chunk.author.values)
+            rnfl = chunk[chunk.subreddit == 'nfl'].drop_duplicates(subset='author', keep='first')
+            firsts.append(rnfl[['author', 'subreddit', 'author_flair_text']])
+    except (KeyError, AttributeError):
+        return filename, None
 
-    inew = []  # List to store indices of comments within the date range
-    
-    # Load the comments 
-    coms = pd.read_csv(filename, lineterminator='\n').dropna(subset=['author', 'body', 'author_flair_text'])
+    n_auth = len(authors)
+    print('Unique authors:', n_auth)
+    author2team = resolve_author_flairs(pd.concat(firsts))
+    del authors, firsts
 
-    # Filter comments by the specified date range
-    for ii, com in coms.iterrows():
-        try:
-            date = datetime.datetime.fromisoformat(com.created_utc.split('T')[0])
-            if date > start and date < stop:
-                inew.append(ii)
-        except AttributeError:
-            print('bad comment')  
-            continue
-    
-    coms = coms.loc[inew]
-    print(len(coms))
-    
+    ##### Second pass: filter, score and write each chunk #####
+    n_all = 0
+    izero = 0
+    flaired_authors = set()
+    sums = {name: np.zeros(3) for name in ['rnfl', 'nfl', 'self', 'other']}  # comments, sentiment sum, controversiality sum
+
+    header = True
+    n_read[:] = [0, 0]
+    lookups = _lookup_counts(cache, scored)
+    for chunk in read_chunks():
+        coms = chunk[chunk.author.isin(author2team.index)]
+        coms['flair'] = registry.encode_subreddits(coms.author.map(author2team))
+        n_all += len(coms)
+        record.drop('unflaired', len(chunk) - len(coms))
+
+        n_flaired = len(coms)
+        coms = coms[(registry.codes(coms.subreddit) >= 0) & (registry.codes(coms.flair) == self_code)]
+        flaired_authors.update(coms.author.values)
+        record.drop('outside_team', n_flaired - len(coms))
+
+        sentiments = score_or_lookup(coms, scored, n_workers=n_workers, chunk_size=chunk_size, cache=cache, backend=backend)
+        if no_zero_sentiment:
+            nonzero = sentiments != 0.0
+            izero += int((~nonzero).sum())
+            coms = coms[nonzero]
+            sentiments = sentiments[nonzero]
+        coms['sentiment'] = sentiments
+
+        for name, mask in subset_masks(coms, subname).items():
+            part = coms[mask]
+            sums[name] += [len(part), part.sentiment.sum(), part.controversiality.sum()]
+
+        coms.to_csv(outfile, mode='w' if header else 'a', header=header)
+        header = False
+
+    print('Number of comments with zero sentiment:', izero)
+
+    n_coms = int(sums['nfl'][0])
+    print('Number of remaining comments:', n_coms)
+
+    # Means from running sums; empty subsets give NaN like the in-memory path
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg = {name: [s[1] / s[0], s[2] / s[0]] for name, s in sums.items()}
+
+    metadata = dict(
+        team=[subname],
+        n_coms=[n_coms],
+        perc_flaired_auth=[len(flaired_authors) / n_auth],
+        perc_rnfl_related=[int(sums['rnfl'][0]) / n_coms],
+        perc_nfl_related=[n_coms / n_all],
+        perc_self_related=[int(sums['self'][0]) / n_coms],
+        perc_other_related=[int(sums['other'][0]) / n_coms],
+        avg_rnfl_sent=[avg['rnfl']],
+        avg_nfl_sent=[avg['nfl']],
+        avg_self_sent=[avg['self']],
+        avg_other_sent=[avg['other']]
+    )
+
+    record.set(rows_in=n_read[0])
+    record.drop('missing_fields', n_read[1])
+    record.drop('zero_sentiment', izero)
+    _record_hit_rates(record, cache, scored, lookups)
+    record.finish(rows_out=n_coms)
+    return outfile, metadata
+
+
+# [start, stop) of the 2022/2023 season phases. The regular season window runs
+# through the Super Bowl, so it contains the playoffs.
+PHASE_WINDOWS = dict(
+    offseason=('2022-03-01', '2022-09-08'),
+    regular=('2022-09-08', '2023-02-13'),
+    playoffs=('2023-01-14', '2023-02-14'),
+)
+
+
+def nfl_week_boundaries(first_start='2021-03-01', season_start='2022-09-08', n_weeks=25):
+    """
+    Boundaries of the NFL weeks used throughout the analysis.
+
+    Week 0 runs from first_start to season_start and every following week is seven days long.
 
+    Parameters:
+    first_start (str): Start date of week 0.
+    season_start (str): Start date of week 1.
+    n_weeks (int): Number of weeks, including week 0.
+
+    Returns:
+    list: Sorted list of n_weeks + 1 datetimes. Week n covers [bounds[n], bounds[n+1]).
+    """
+    season_start = datetime.datetime.fromisoformat(season_start)
+    dweek = datetime.timedelta(days=7)
+    return [datetime.datetime.fromisoformat(first_start)] + [season_start + week * dweek for week in range(n_weeks)]
+
+
+def parse_comment_dates(coms):
+    """
+    Parse the date part of 'created_utc' for every comment.
+
+    Parameters:
+    coms (DataFrame): Comments with 'created_utc' strings like '2023-03-14T07:51:15Z'.
+
+    Returns:
+    Series: Comment dates at midnight, NaT where created_utc is missing or malformed.
+    """
+    if pd.api.types.is_datetime64_any_dtype(coms.created_utc):
+        return coms.created_utc.dt.normalize()
+    return pd.to_datetime(coms.created_utc.astype(str).str[:10], format='%Y-%m-%d', errors='coerce')
+
+
+def assign_buckets(dates, bounds):
+    """
+    Assign dates to the [bounds[i], bounds[i+1]) interval they fall in.
+
+    Parameters:
+    dates (Series): Comment dates.
+    bounds (list): Sorted interval boundaries.
+
+    Returns:
+    np.ndarray: Bucket index for each date, -1 for dates outside all intervals or missing.
+    """
+    bounds = pd.to_datetime(pd.Series(bounds)).values
+    values = dates.values
+    ibucket = np.searchsorted(bounds, values, side='right') - 1
+    ibucket[(ibucket >= len(bounds) - 1) | pd.isna(values)] = -1
+    return ibucket
+
+
+def window_metadata(coms, subname):
+    """
+    Summary metrics for a team's processed comments within a time window.
+
+    Parameters:
+    coms (DataFrame): Processed comments of a team within the window.
+    subname (str): Team subreddit.
+
+    Returns:
+    dict: Metadata in the same layout as process_coms.
+    """
     n_coms = len(coms)  
     n_all = n_coms
     n_auth = len(np.unique(coms.author)) 
     n_flaired_auth = n_auth  
     
-    # Categorize comments i
-    rnfl = coms[coms.subreddit.isin(['nfl'])]  # Comments in the 'nfl' subreddit
-    nfl = coms[coms.subreddit.isin(all_nfl_subs)]  # Comments in all NFL-related subreddits
-    selfc = coms[coms.subreddit.isin([subname])]  # Comments in the current team's subreddit
-    other = coms[coms.subreddit.isin(all_other_team_subs)]  # Comments in all other teams' subreddits
+    # Categorize comments by their subreddit code
+    masks = subset_masks(coms, subname)
+    rnfl = coms[masks['rnfl']]  # Comments in the 'nfl' subreddit
+    nfl = coms[masks['nfl']]  # Comments in all NFL-related subreddits
+    selfc = coms[masks['self']]  # Comments in the current team's subreddit
+    other = coms[masks['other']]  # Comments in all other teams' subreddits
     
     n_rnfl = len(rnfl)
     n_nfl = len(nfl)
@@ -275,10 +535,12 @@ def filter_processed_coms_by_date(filename, start, stop):
     perc_flaired_auth = n_flaired_auth / n_auth
     
     # Calculate the average sentiment and controversiality for each subset
-    avg_rnfl_sent = [rnfl.sentiment.mean(), rnfl.controversiality.sum() / len(rnfl)]
-    avg_nfl_sent = [nfl.sentiment.mean(), nfl.controversiality.sum() / len(nfl)]
-    avg_self_sent = [selfc.sentiment.mean(), selfc.controversiality.sum() / len(selfc)]
-    avg_other_sent = [other.sentiment.mean(), other.controversiality.sum() / len(other)]
+    # Subsets are often empty in a single week; their averages are NaN, without a warning
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_rnfl_sent = [rnfl.sentiment.mean(), rnfl.controversiality.sum() / len(rnfl)]
+        avg_nfl_sent = [nfl.sentiment.mean(), nfl.controversiality.sum() / len(nfl)]
+        avg_self_sent = [selfc.sentiment.mean(), selfc.controversiality.sum() / len(selfc)]
+        avg_other_sent = [other.sentiment.mean(), other.controversiality.sum() / len(other)]
     
     # Create a metadata dictionary with the calculated metrics
     metadata = dict(
@@ -295,15 +557,156 @@ def filter_processed_coms_by_date(filename, start, stop):
         avg_other_sent=[avg_other_sent]
     )
     
-    return coms, metadata
+    return metadata
+
+
+def filter_processed_coms_by_date(filename, start, stop):
+    """
+    Filters and processes comments from a CSV file within a specified date range and returns the filtered comments along with metadata.
+
+    Parameters:
+    filename (str): The path to the CSV file containing comments data.
+    start (datetime): The start date for filtering comments.
+    stop (datetime): The end date for filtering comments.
+
+    Returns:
+    tuple: A tuple containing:
+        - coms (DataFrame): A pandas DataFrame with the filtered comments.
+        - metadata (dict): A dictionary containing metadata about the filtered comments.
+    """
+    subname = filename.split('/')[-1].split('.')[0]
+    
+    print(subname)
+    
+    # Load the comments, letting the columnar store skip row groups outside the window.
+    # CSV files are read whole, without pyarrow
+    window = None
+    if is_store(filename):
+        import pyarrow.dataset as ds
+        window = (ds.field('created_utc') >= pd.Timestamp(start)) & (ds.field('created_utc') < pd.Timestamp(stop))
+    coms = read_coms(filename, filter=window).dropna(subset=['author', 'body', 'author_flair_text'])
+
+    # Filter comments by the specified date range
+    dates = parse_comment_dates(coms)
+    print('bad comments:', int(dates.isna().sum()))
+    coms = coms[(dates > start) & (dates < stop)]
+    print(len(coms))
+
+    return coms, window_metadata(coms, subname)
+
+
+def partition_processed_coms(filename, week_bounds=None, phase_windows=PHASE_WINDOWS):
+    """
+    Split a team's processed comments into NFL weeks and season phases in a single read.
+
+    Parameters:
+    filename (str): The path to the CSV file containing processed comments.
+    week_bounds (list): Sorted week boundaries. Defaults to nfl_week_boundaries().
+    phase_windows (dict): (start, stop) date strings for each season phase.
+
+    Returns:
+    tuple: A tuple containing:
+        - weeks (dict): (coms, metadata) for each week number.
+        - phases (dict): (coms, metadata) for each phase name.
+    """
+    if week_bounds is None:
+        week_bounds = nfl_week_boundaries()
+
+    subname = filename.split('/')[-1].split('.')[0]
+    print(subname)
 
-def get_sub_edges(filename, sublist):
+    coms = read_coms(filename).dropna(subset=['author', 'body', 'author_flair_text'])
+    dates = parse_comment_dates(coms)
+
+    iweek = assign_buckets(dates, week_bounds)
+
+    weeks = dict()
+    for week in range(len(week_bounds) - 1):
+        d = coms[iweek == week]
+        weeks[week] = (d, window_metadata(d, subname))
+
+    phases = dict()
+    for phase, (start, stop) in phase_windows.items():
+        d = coms[(dates >= start) & (dates < stop)]
+        phases[phase] = (d, window_metadata(d, subname))
+
+    return weeks, phases
+
+
+def write_team_partitions(filename, outdir, week_bounds=None, phase_windows=PHASE_WINDOWS, report=None):
+    """
+    Write one team's per-week and per-phase comments.
+
+    Parameters:
+    filename (str): Processed comment CSV of the team.
+    outdir (str): Root output folder, e.g. 'data/nfl_nonzero'.
+    week_bounds (list): Sorted week boundaries. Defaults to nfl_week_boundaries().
+    phase_windows (dict): (start, stop) date strings for each season phase.
+    report (RunReport): Optional run report to record timings and row counts in.
+
+    Returns:
+    metadata (dict): The team's metadata for each output folder, such as 'weeks/3' or 'regular'.
+    """
+    subname = filename.split('/')[-1].split('.')[0]
+    record = start_stage(report, 'write_team_partitions', team=subname)
+    weeks, phases = partition_processed_coms(filename, week_bounds, phase_windows)
+
+    metadata = dict()
+    buckets = [('weeks/{}'.format(week), v) for week, v in weeks.items()] + list(phases.items())
+    for folder, (d, meta) in buckets:
+        os.makedirs('{}/{}/comments'.format(outdir, folder), exist_ok=True)
+        d.to_csv('{}/{}/comments/{}.csv'.format(outdir, folder, subname))
+        metadata[folder] = meta
+
+    record.finish(rows_out=sum(len(d) for d, _ in weeks.values()), files=len(buckets))
+    return metadata
+
+
+def write_partition_metadata(team_metadata, outdir):
+    """
+    Write <outdir>/<folder>/metadata.csv with one row per team.
+
+    Parameters:
+    team_metadata (list): Metadata returned by write_team_partitions for each team, in row order.
+    outdir (str): Root output folder.
+    """
+    metadata = dict()
+    for team_meta in team_metadata:
+        for folder, meta in team_meta.items():
+            if folder not in metadata:
+                metadata[folder] = {key: list(value) for key, value in meta.items()}
+            else:
+                for key in metadata[folder]:
+                    metadata[folder][key] += meta[key]
+
+    for folder, meta in metadata.items():
+        pd.DataFrame(meta).to_csv('{}/{}/metadata.csv'.format(outdir, folder))
+
+
+def write_season_partitions(filenames, outdir, week_bounds=None, phase_windows=PHASE_WINDOWS):
+    """
+    Write per-week and per-phase comments and metadata for all teams.
+
+    Outputs go to <outdir>/weeks/<week>/ and <outdir>/<phase>/, each with a comments/
+    folder holding one CSV per team and a metadata.csv with one row per team.
+
+    Parameters:
+    filenames (list): Processed comment CSVs, one per team.
+    outdir (str): Root output folder, e.g. 'data/nfl_nonzero'.
+    week_bounds (list): Sorted week boundaries. Defaults to nfl_week_boundaries().
+    phase_windows (dict): (start, stop) date strings for each season phase.
+    """
+    team_metadata = [write_team_partitions(filename, outdir, week_bounds, phase_windows) for filename in filenames]
+    write_partition_metadata(team_metadata, outdir)
+
+def get_sub_edges(filename, sublist, report=None):
     """
     Construct edges between a given team subreddit and other subreddits based off of user interactions.
 
     Args:
     - filename (str): Path to the CSV file containing comments.
     - sublist (list): List of subreddit names to consider for relationships.
+    - report (RunReport): Optional run report to record timings, row counts and drops in.
 
     Returns:
     - edges (list): List of tuples representing edges between subreddits in sublist.
@@ -313,53 +716,81 @@ def get_sub_edges(filename, sublist):
     # Extract subname from the filename
     subname = filename.split('/')[-1].split('.')[0].split('_')[0]
     print(subname)
-    # Dictionary to store edge information
-    sub_edge_dict = dict()
-
-
-    # Read comments
-    coms = pd.read_csv(filename, lineterminator='\n').dropna(subset=['subreddit', 'body'])
+    record = start_stage(report, 'get_sub_edges', team=subname)
+
+    # Read comments. The columnar store only holds processed comments, so bodies need not be loaded
+    if is_store(filename):
+        coms = read_coms(filename, columns=['subreddit', 'sentiment', 'controversiality', 'score'])
+        n_read = len(coms)
+        coms = coms.dropna(subset=['subreddit'])
+    else:
+        coms = read_coms(filename)
+        n_read = len(coms)
+        coms = coms.dropna(subset=['subreddit', 'body'])
     print('Number of comments:', len(coms))
+    record.drop('missing_fields', n_read - len(coms))
 
     # Convert subreddit names to lowercase
     coms.subreddit = coms.subreddit.str.lower()
 
     # Filter comments to include only those in the specified sublist of subreddits
+    n_valid = len(coms)
     coms = coms[coms.subreddit.isin(sublist)]
+    record.drop('outside_sublist', n_valid - len(coms))
 
-    # Create edges between subreddits in coms
-    sub_edges = [(subname, com.subreddit) for ii, com in coms.iterrows()]
-
-    # Populate sub_edge_dict with edge information
-    for ii, edge in enumerate(sub_edges):
-        if edge not in sub_edge_dict:
-            # Initialize edge metrics if the edge is encountered for the first time
-            sub_edge_dict[edge] = [1, coms.sentiment.iloc[ii], coms.controversiality.iloc[ii], coms.score.iloc[ii]]
-        else:
-            # increment metrics if the edge has been encountered before
-            sub_edge_dict[edge][0] += 1
-            sub_edge_dict[edge][1] += coms.sentiment.iloc[ii]
-            sub_edge_dict[edge][2] += coms.controversiality.iloc[ii]
-            sub_edge_dict[edge][3] += coms.score.iloc[ii]
-
-    # Normalize based on how users interact on their own team's subreddit
-    norm = sub_edge_dict[(subname, subname)][0] # volume of posts on own subreddit
-    scorenorm = sub_edge_dict[(subname, subname)][3] # sentiment of posts on own subreddit
+    edges = normalize_edges(aggregate_edge_sums(coms), subname)
+    record.finish(rows_in=n_read, rows_out=len(edges), comments=len(coms))
+    return edges
 
-    edges = []
 
-    # Compile normalized edge statistics
-    for edge in sub_edge_dict:
-        edges.append((
-            edge[0],  # Source subreddit (subname)
-            edge[1],  # Target subreddit
-            sub_edge_dict[edge][0] / norm,  # Normalized frequency of interactions
-            sub_edge_dict[edge][1] / sub_edge_dict[edge][0],  # Normalized average sentiment
-            sub_edge_dict[edge][2] / sub_edge_dict[edge][0],  # Normalized average controversiality
-            sub_edge_dict[edge][3] / (sub_edge_dict[edge][0] * scorenorm)  # Normalized average score
-        ))
+def aggregate_edge_sums(coms):
+    """
+    Sum comment metrics per target subreddit.
 
-    return edges
+    Args:
+    - coms (pd.DataFrame): Comments by fans of one team, with 'subreddit', 'sentiment',
+                           'controversiality' and 'score' columns.
+
+    Returns:
+    - sums (pd.DataFrame): Indexed by target subreddit in order of first appearance, with
+                           columns count, sentiment, controversiality and score.
+    """
+    grouped = coms.groupby('subreddit', sort=False)
+    sums = grouped[['sentiment', 'controversiality', 'score']].sum()
+    sums.insert(0, 'count', grouped.size())
+    return sums
+
+
+def normalize_edges(sums, subname):
+    """
+    Turn per-target sums into normalized edge tuples.
+
+    Volume is normalized by the number of comments fans leave in their own subreddit,
+    and score by the total score of those comments.
+
+    Args:
+    - sums (pd.DataFrame): Output of aggregate_edge_sums.
+    - subname (str): Source team subreddit.
+
+    Returns:
+    - edges (list): (source_subreddit, target_subreddit, volume, sentiment, controversiality, score)
+                    tuples. Empty if the team has no comments in its own subreddit.
+    """
+    # Normalization is undefined without any comments on the team's own subreddit
+    if subname not in sums.index:
+        print('No self comments for', subname)
+        return []
+
+    norm = sums['count'][subname]  # volume of posts on own subreddit
+    scorenorm = sums['score'][subname]  # total score of posts on own subreddit
+
+    count = sums['count'].values
+    volume = count / norm  # Normalized frequency of interactions
+    sent = sums['sentiment'].values / count  # Normalized average sentiment
+    cont = sums['controversiality'].values / count  # Normalized average controversiality
+    score = sums['score'].values / (count * scorenorm)  # Normalized average score
+
+    return [(subname, target, *metrics) for target, *metrics in zip(sums.index, volume, sent, cont, score)]
 
 def get_division_edges(sublist):
     """
@@ -378,7 +809,7 @@ def get_division_edges(sublist):
     return edges
 
 
-def get_rivalry_graph(sublist, output='plots/tmp.png', ink_scale=1, norm_scale=3):
+def get_rivalry_graph(sublist, output='plots/tmp.png', ink_scale=1, norm_scale=3, raw_edges=None):
     """
     Generates a rivalry graph from a list of edges describing commenting traffic in NFL team subreddits.
 
@@ -387,12 +818,17 @@ def get_rivalry_graph(sublist, output='plots/tmp.png', ink_scale=1, norm_scale=3
     output (str): Output path
     ink_scale (float): Scale factor for the ink used in rendering the graph. Default is 1.
     norm_scale (float): Normalization scale factor applied to edge weights. Default is 3.
+    raw_edges (list): Precomputed edges among sublist, e.g. from InteractionCube.edge_list. Read from
+                      the team files with get_division_edges if not given. To draw many subsets or
+                      buckets, see render.render_frames.
 
     Returns:
     tuple: A tuple containing the graph-tool module (gt) and the rendered image.
     """
     # Generate raw edges from the sublist
-    raw_edges = get_division_edges(sublist)
+    if raw_edges is None:
+        raw_edges = get_division_edges(sublist)
+    raw_edges = [e for e in raw_edges if e[0] in sublist and e[1] in sublist]
 
     # Normalize the edge weights based on the maximum weight
     norm = max([e[2] for e in raw_edges])
@@ -405,6 +841,7 @@ def get_rivalry_graph(sublist, output='plots/tmp.png', ink_scale=1, norm_scale=3
     edges = [(sub2id[e[0]], sub2id[e[1]], norm_scale * e[2] / norm, e[3]) for e in raw_edges]
 
     # Initialize a directed graph using graph-tool
+    gt = graph_backend()
     ug = gt.Graph(directed=True)
     eweight = ug.new_ep('double')  # Edge weight property
     sweight = ug.new_ep('double')  # Edge color property
@@ -417,7 +854,7 @@ def get_rivalry_graph(sublist, output='plots/tmp.png', ink_scale=1, norm_scale=3
     ug.vp.vname = vname
     for k, name in sorted(id2sub.items()):
         v = ug.vertex(k)
-        ug.vp.vname[v] = team2abbrev[name]
+        ug.vp.vname[v] = default_registry().team2abbrev[name]
 
     # Draw the graph and save it as an image
     image = gt.graph_draw(
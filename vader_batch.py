@@ -0,0 +1,262 @@
+import re
+import string
+import numpy as np
+import pandas as pd
+from itertools import chain
+from nltk import tokenize
+from vaderSentiment import vaderSentiment as vader
+
+# Largest difference from SentimentIntensityAnalyzer.polarity_scores(...)['compound'].
+# Both round to 4 decimals, and NumPy and Python can round a tie differently.
+TOLERANCE = 1e-4
+
+
+# Words the rules look up by id
+RULE_WORDS = sorted(set(
+    ['no', 'or', 'nor', 'kind', 'of', 'never', 'so', 'this', 'without', 'doubt', 'least', 'at', 'very', 'but']
+    + [word for phrase in list(vader.SPECIAL_CASES) + list(vader.BOOSTER_DICT) for word in phrase.split(' ')]))
+
+
+def _strip_punc_if_word(token):
+    # Same rule as vader.SentiText: keep short tokens such as ':)' intact
+    stripped = token.strip(string.punctuation)
+    return token if len(stripped) <= 2 else stripped
+
+
+class BatchVader:
+    """
+    VADER compound scores for many sentences at once.
+
+    The lexicon, booster, negation and idiom rules of vaderSentiment are compiled into lookup
+    tables over the distinct words of a batch. Every sentence is then scored with array
+    operations over the flattened tokens, instead of one polarity_scores call per sentence.
+    Scores match the reference analyzer within TOLERANCE.
+
+    Parameters:
+    - analyzer (SentimentIntensityAnalyzer): Analyzer whose lexicon and emoji table are used. Defaults to a new one.
+    """
+
+    def __init__(self, analyzer=None):
+        if analyzer is None:
+            analyzer = vader.SentimentIntensityAnalyzer()
+        self.lexicon = analyzer.lexicon
+
+        # polarity_scores replaces emojis one character at a time
+        self.emojis = {k: v for k, v in analyzer.emojis.items() if len(k) == 1}
+        self.emoji_chars = set(self.emojis)
+
+    def replace_emojis(self, text):
+        """
+        Replace emojis with their descriptions, as polarity_scores does.
+        """
+        if text.isascii():
+            return text
+        found = self.emoji_chars.intersection(text)
+        if not found:
+            return text
+
+        def describe(match):
+            i = match.start()
+            return ('' if i == 0 or text[i - 1] == ' ' else ' ') + self.emojis[match.group()]
+
+        return re.sub('[{}]'.format(''.join(re.escape(c) for c in found)), describe, text)
+
+    def score_sentences(self, sentences):
+        """
+        Compound score of each sentence.
+
+        Args:
+        - sentences (list): Sentence strings.
+
+        Returns:
+        - compound (np.ndarray): polarity_scores(sentence)['compound'] for every sentence.
+        """
+        texts = [self.replace_emojis(s) for s in sentences]
+        tokens = [text.split() for text in texts]
+        lengths = np.array([len(t) for t in tokens], dtype=np.int64)
+        n = len(texts)
+
+        # Per-token work is a hash lookup; string rules run once per distinct token
+        raw_ids, raw_words = pd.factorize(pd.Series(list(chain.from_iterable(tokens)), dtype=object))
+        words = [_strip_punc_if_word(t) for t in raw_words]
+        lower_ids, vocab = pd.factorize(pd.Series([word.lower() for word in words], dtype=object))
+        w = lower_ids[raw_ids] if len(raw_ids) else np.zeros(0, dtype=np.int64)
+        up = np.array([word.isupper() for word in words], dtype=bool)[raw_ids]
+
+        # -2 marks rule words missing from the batch: it matches neither a token nor a missing neighbour (-1)
+        i = dict(zip(RULE_WORDS, vocab.get_indexer(RULE_WORDS)))
+        i = {word: idx if idx >= 0 else -2 for word, idx in i.items()}
+
+        valence = self._scores(w, up, lengths, vocab, i)
+        valence = self._but_check(valence, w, lengths, vocab, i)
+
+        sid = np.repeat(np.arange(n), lengths)
+        sums = np.bincount(sid, valence, minlength=n)
+
+        ep = np.minimum([text.count('!') for text in texts], 4) * 0.292
+        qm = np.array([text.count('?') for text in texts])
+        amplifier = ep + np.where(qm > 1, np.where(qm <= 3, qm * 0.18, 0.96), 0.)
+        sums = np.where(sums > 0, sums + amplifier, np.where(sums < 0, sums - amplifier, sums))
+
+        compound = np.clip(sums / np.sqrt(sums * sums + 15), -1., 1.)
+        return np.where(lengths > 0, np.round(compound, 4), 0.)
+
+    def score_comments(self, bodies):
+        """
+        Average compound score over the sentences of each comment, as comment_sentiment does.
+
+        Args:
+        - bodies (array-like): Comment texts.
+
+        Returns:
+        - sentiments (np.ndarray): Comment sentiment scores. 0 for comments without sentences.
+        """
+        sentences = [tokenize.sent_tokenize(body) for body in bodies]
+        counts = np.array([len(s) for s in sentences], dtype=np.int64)
+        compound = self.score_sentences(list(chain.from_iterable(sentences)))
+
+        cid = np.repeat(np.arange(len(sentences)), counts)
+        totals = np.bincount(cid, compound, minlength=len(sentences))
+        # Empty or whitespace-only bodies have no sentences and score 0, as in comment_sentiment
+        return totals / np.maximum(counts, 1)
+
+    def _scores(self, w, up, lengths, vocab, i):
+        """
+        Valence of every token after the word-level rules of sentiment_valence.
+        """
+        T = len(w)
+        start = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        pos = np.arange(T) - start
+        rest = np.repeat(lengths, lengths) - pos - 1  # tokens after this one in the sentence
+
+        # Lookup tables over the vocabulary, with a sentinel entry at index -1 for missing neighbours
+        lex = np.array([self.lexicon.get(word, np.nan) for word in vocab] + [np.nan])
+        in_lex = ~np.isnan(lex)
+        booster = np.array([vader.BOOSTER_DICT.get(word, 0.) for word in vocab] + [0.])
+        is_booster = np.array([word in vader.BOOSTER_DICT for word in vocab] + [False])
+        negate = set(vader.NEGATE)
+        is_neg = np.array([word in negate or "n't" in word for word in vocab] + [False])
+
+        def prev(a, k, fill):
+            out = np.full(T, fill, dtype=a.dtype)
+            if k < T:
+                out[k:] = a[:T - k]
+            out[pos < k] = fill
+            return out
+
+        def nxt(a, k, fill):
+            out = np.full(T, fill, dtype=a.dtype)
+            if k < T:
+                out[:T - k] = a[k:]
+            out[rest < k] = fill
+            return out
+
+        wm = [w] + [prev(w, k, -1) for k in (1, 2, 3)]  # wm[k]: word k positions back
+        upm = [up] + [prev(up, k, False) for k in (1, 2, 3)]
+        wp1, wp2 = nxt(w, 1, -1), nxt(w, 2, -1)
+        cap_diff = np.bincount(np.repeat(np.arange(len(lengths)), lengths), up, minlength=len(lengths))
+        cap_diff = np.repeat((cap_diff > 0) & (cap_diff < lengths), lengths)
+
+        def isin(a, *names):
+            return np.isin(a, [i[name] for name in names if i[name] >= 0])
+
+        scored = in_lex[w] & ~is_booster[w] & ~((w == i['kind']) & (wp1 == i['of']))
+
+        v = lex[w].copy()
+        v[(w == i['no']) & in_lex[wp1]] = 0.
+        no = (wm[1] == i['no']) | (wm[2] == i['no']) | ((wm[3] == i['no']) & isin(wm[1], 'or', 'nor'))
+        v = np.where(no, lex[w] * vader.N_SCALAR, v)
+        v = np.where(up & cap_diff, np.where(v > 0, v + vader.C_INCR, v - vader.C_INCR), v)
+
+        # Boosters and negations up to three words back, in the order polarity_scores applies them
+        for k, damp in zip((1, 2, 3), (1., 0.95, 0.9)):
+            active = (wm[k] >= 0) & ~in_lex[wm[k]]
+
+            s = np.where(v < 0, -booster[wm[k]], booster[wm[k]])
+            s = np.where(is_booster[wm[k]] & upm[k] & cap_diff, np.where(v > 0, s + vader.C_INCR, s - vader.C_INCR), s)
+            v = np.where(active, v + s * damp, v)
+
+            if k == 1:
+                scale = np.where(is_neg[wm[1]], vader.N_SCALAR, 1.)
+            elif k == 2:
+                never = (wm[2] == i['never']) & isin(wm[1], 'so', 'this')
+                doubt = (wm[2] == i['without']) & (wm[1] == i['doubt'])
+                scale = np.where(never, 1.25, np.where(doubt, 1., np.where(is_neg[wm[2]], vader.N_SCALAR, 1.)))
+            else:
+                never = ((wm[3] == i['never']) & isin(wm[2], 'so', 'this')) | isin(wm[1], 'so', 'this')
+                doubt = (wm[3] == i['without']) & ((wm[2] == i['doubt']) | (wm[1] == i['doubt']))
+                scale = np.where(never, 1.25, np.where(doubt, 1., np.where(is_neg[wm[3]], vader.N_SCALAR, 1.)))
+            v = np.where(active, v * scale, v)
+
+            if k == 3:
+                v = np.where(active, self._idioms_check(v, i, wm, wp1, wp2), v)
+
+        least = (wm[1] == i['least']) & ~in_lex[wm[1]]
+        v = np.where(least & (wm[2] >= 0) & ~isin(wm[2], 'at', 'very'), v * vader.N_SCALAR, v)
+        v = np.where(least & (wm[2] < 0), v * vader.N_SCALAR, v)
+
+        return np.where(scored, v, 0.)
+
+    @staticmethod
+    def _idioms_check(v, i, wm, wp1, wp2):
+        """
+        Vectorized _special_idioms_check for tokens with three preceding words.
+        """
+        def match(seq, phrase):
+            ids = [i[word] for word in phrase.split(' ')]
+            if len(ids) != len(seq) or min(ids) < 0:
+                return np.zeros(len(v), dtype=bool)
+            return np.logical_and.reduce([a == b for a, b in zip(seq, ids)])
+
+        def special(seq):
+            value = np.full(len(v), np.nan)
+            for phrase, val in vader.SPECIAL_CASES.items():
+                value[match(seq, phrase)] = val
+            return value
+
+        # The first preceding n-gram found in SPECIAL_CASES wins, then following n-grams override it
+        preceding = [(wm[1], wm[0]), (wm[2], wm[1], wm[0]), (wm[2], wm[1]), (wm[3], wm[2], wm[1]), (wm[3], wm[2])]
+        for seq in preceding[::-1] + [(wm[0], wp1), (wm[0], wp1, wp2)]:
+            value = special(seq)
+            v = np.where(np.isnan(value), v, value)
+
+        for seq in [(wm[3], wm[2], wm[1]), (wm[3], wm[2]), (wm[2], wm[1])]:
+            for phrase, val in vader.BOOSTER_DICT.items():
+                if ' ' in phrase:
+                    v = np.where(match(seq, phrase), v + val, v)
+        return v
+
+    @staticmethod
+    def _but_check(valence, w, lengths, vocab, i):
+        """
+        Vectorized _but_check: words before the first 'but' of a sentence are halved and words after it grow by half.
+
+        The reference finds each word with list.index, so a word whose value equals an earlier,
+        already rescaled word rescales that one instead. Sentences where this happens are
+        passed to the reference implementation.
+        """
+        is_but = w == i['but']
+        if not is_but.any():
+            return valence
+
+        n = len(lengths)
+        sid = np.repeat(np.arange(n), lengths)
+        starts = np.cumsum(lengths) - lengths
+        pos = np.arange(len(w)) - starts[sid]
+
+        # Position of the first 'but' of each sentence, -1 for sentences without one
+        first = np.full(n, len(w))
+        np.minimum.at(first, sid[is_but], pos[is_but])
+        bi = np.where(first < len(w), first, -1)[sid]
+        has_but = bi >= 0
+        scaled = np.where(has_but & (pos < bi), valence * 0.5, np.where(has_but & (pos > bi), valence * 1.5, valence))
+
+        # Look for a word whose value equals the rescaled value of an earlier word
+        nz = has_but & (valence != 0)
+        before = pd.DataFrame(dict(s=sid[nz], v=scaled[nz], p=pos[nz]))
+        after = pd.DataFrame(dict(s=sid[nz], v=valence[nz], p=pos[nz]))
+        clash = before.merge(after, on=['s', 'v'])
+        for s in np.unique(clash.s[clash.p_x < clash.p_y]):
+            lo, hi = starts[s], starts[s] + lengths[s]
+            scaled[lo:hi] = vader.SentimentIntensityAnalyzer._but_check(list(vocab[w[lo:hi]]), list(valence[lo:hi]))
+        return scaled